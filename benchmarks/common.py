@@ -0,0 +1,114 @@
+"""Statistics and baselines shared by the benchmarks."""
+
+import json
+import platform
+import statistics
+from datetime import datetime, timezone
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+def summarize(samples, elapsed=None):
+    """Latency percentiles in milliseconds, and throughput if `elapsed` is given."""
+    samples = sorted(samples)
+    summary = {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p90_ms": percentile(samples, 0.90) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": samples[-1] * 1000 if samples else 0.0,
+    }
+    if elapsed:
+        summary["per_second"] = len(samples) / elapsed
+    return summary
+
+
+def print_table(results):
+    print(
+        f"{'':24} {'count':>8} {'per sec':>9} {'mean':>9} {'p50':>9} "
+        f"{'p90':>9} {'p99':>9} {'max':>9}"
+    )
+    for name, summary in results.items():
+        per_second = summary.get("per_second")
+        per_second = f"{per_second:9.1f}" if per_second is not None else f"{'-':>9}"
+        print(
+            f"{name:24} {summary['count']:8d} {per_second} "
+            f"{summary['mean_ms']:8.2f}ms {summary['p50_ms']:8.2f}ms "
+            f"{summary['p90_ms']:8.2f}ms {summary['p99_ms']:8.2f}ms "
+            f"{summary['max_ms']:8.2f}ms"
+        )
+
+
+def save_baseline(path, results, parameters):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "machine": platform.platform(),
+                "parameters": parameters,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nBaseline saved to {path}")
+
+
+def compare_baseline(path, results, tolerance):
+    """Print how `results` compare to a saved baseline.
+
+    Returns the number of regressions: a p99 latency more than `tolerance`
+    (a fraction) above the baseline, or a throughput more than it below.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared to {path} ({baseline['created_at']}):")
+
+    regressions = 0
+    for name, summary in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        checks = [("p99_ms", 1), ("per_second", -1)]
+        for key, direction in checks:
+            if not before.get(key) or key not in summary:
+                continue
+            change = (summary[key] - before[key]) / before[key]
+            regressed = change * direction > tolerance
+            regressions += regressed
+            print(
+                f"{'REGRESSED' if regressed else 'ok':9} {name:24} {key:10} "
+                f"{before[key]:10.2f} -> {summary[key]:10.2f} ({change:+.0%})"
+            )
+    return regressions
+
+
+def add_baseline_arguments(parser):
+    parser.add_argument(
+        "--save", metavar="FILE", help="Save the results as a baseline."
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Compare the results with a saved baseline."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Regression allowed before --compare fails, as a fraction.",
+    )
+
+
+def finish(args, results, parameters):
+    """Report the results and handle --save/--compare, returning the exit code."""
+    print_table(results)
+    if args.save:
+        save_baseline(args.save, results, parameters)
+    if args.compare and compare_baseline(args.compare, results, args.tolerance):
+        return 1
+    return 0
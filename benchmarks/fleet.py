@@ -0,0 +1,296 @@
+"""
+Load test a running server with a fleet of simulated TRMNL devices.
+
+Every device registers through /api/setup/, then polls /api/display/ every
+--interval seconds, downloads its image whenever the filename changes (as
+the firmware does) and posts a log every --log-every polls. Latency
+percentiles and throughput are reported per request type.
+
+    python manage.py runserver 0.0.0.0:8000
+    python benchmarks/fleet.py --url http://127.0.0.1:8000 --devices 200 --duration 60
+
+Unclaimed devices only ever get the setup screen. --owner claims them for an
+existing user and gives each a screen, through the server's database, so
+this must run with the same settings (e.g. DB_FILE) as the server. Save a
+baseline with --save and check a later run against it with --compare.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from common import add_baseline_arguments, finish, summarize
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+LOG_MESSAGE = {
+    "log": {
+        "logs_array": [
+            {
+                "creation_timestamp": 0,
+                "device_status_stamp": {"battery_voltage": 3.9, "wifi_rssi_level": -60},
+                "log_message": "returned code is not OK: 404",
+                "log_codeline": 449,
+            }
+        ]
+    }
+}
+
+
+class VirtualDevice:
+    def __init__(self, mac_address):
+        self.mac_address = mac_address
+        self.api_key = None
+        self.friendly_id = None
+        self.filename = None
+        self.polls = 0
+
+
+class Fleet:
+    def __init__(self, url, interval, log_every, timeout):
+        self.url = url.rstrip("/")
+        self.interval = interval
+        self.log_every = log_every
+        self.timeout = timeout
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self.lag = []
+        self._lock = threading.Lock()
+
+    def request(self, kind, path_or_url, headers, body=None):
+        """Make a request, recording its latency, and return the response body."""
+        url = path_or_url if "://" in path_or_url else self.url + path_or_url
+        request = urllib.request.Request(url, data=body, headers=headers)
+        start_time = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            status = getattr(e, "code", type(e).__name__)
+            with self._lock:
+                self.errors[f"{kind} {status}"] += 1
+            return None
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            self.samples[kind].append(elapsed)
+        return data
+
+    def setup(self, device):
+        data = self.request("setup", "/api/setup/", {"ID": device.mac_address})
+        if data:
+            body = json.loads(data)
+            device.api_key = body.get("api_key")
+            device.friendly_id = body.get("friendly_id")
+
+    def poll(self, device):
+        headers = {"ID": device.mac_address, "Access-Token": device.api_key}
+        data = self.request("display", "/api/display/", headers)
+        if data:
+            body = json.loads(data)
+            # the firmware only downloads an image it doesn't have yet
+            image_url = body.get("image_url") or ""
+            if body.get("filename") != device.filename and image_url.startswith(
+                self.url
+            ):
+                if self.request("image", image_url, {}) is not None:
+                    device.filename = body["filename"]
+
+        device.polls += 1
+        if self.log_every and device.polls % self.log_every == 0:
+            self.request(
+                "log",
+                "/api/log",
+                {"Access-Token": device.api_key, "Content-Type": "application/json"},
+                json.dumps(LOG_MESSAGE).encode(),
+            )
+
+    def run(self, devices, duration, concurrency):
+        """Poll with every device until `duration` seconds have passed."""
+        start_time = time.monotonic()
+        end_time = start_time + duration
+        # spread the first polls over one interval, like a fleet that has
+        # been running for a while
+        schedule = [
+            (start_time + random.uniform(0, self.interval), i)
+            for i in range(len(devices))
+        ]
+        heapq.heapify(schedule)
+        schedule_lock = threading.Lock()
+
+        def work():
+            while True:
+                with schedule_lock:
+                    due, index = heapq.heappop(schedule)
+                    if due >= end_time:
+                        heapq.heappush(schedule, (due, index))
+                        return
+                time.sleep(max(0, due - time.monotonic()))
+                with self._lock:
+                    self.lag.append(time.monotonic() - due)
+                self.poll(devices[index])
+                with schedule_lock:
+                    heapq.heappush(schedule, (due + self.interval, index))
+
+        # a thread holds one device at a time, so more than there are devices
+        # would find the schedule empty
+        threads = [
+            threading.Thread(target=work) for _ in range(min(concurrency, len(devices)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start_time
+
+
+def claim_devices(devices, owner):
+    """Give the devices to `owner`, each with a screen, through the database.
+
+    Devices claimed by an earlier run are set up again as well, the server
+    no longer hands out their API keys.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "byos_django.settings")
+
+    import django
+
+    django.setup()
+
+    import numpy as np
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from trmnl.imaging import encode_bmp
+    from trmnl.models import Device, Screen
+    from trmnl.polling import invalidate_device
+    from trmnl.storage import get_blob_store
+
+    user = User.objects.get(username=owner)
+    by_mac = {device.mac_address: device for device in devices}
+    found = list(Device.objects.filter(mac_address__in=by_mac))
+    for device in found:
+        by_mac[device.mac_address].api_key = device.api_key
+    unclaimed = [device for device in found if device.user_id is None]
+    Device.objects.filter(pk__in=[device.pk for device in unclaimed]).update(user=user)
+
+    image_hash = get_blob_store().put(encode_bmp(np.ones((480, 800), dtype=bool)))
+    Screen.objects.bulk_create(
+        Screen(
+            device=device,
+            html="<p>Benchmark</p>",
+            image_hash=image_hash,
+            generated=True,
+            status=Screen.Status.DONE,
+            rendered_at=timezone.now(),
+        )
+        for device in unclaimed
+    )
+    for device in unclaimed:
+        invalidate_device(device)
+    if unclaimed and not os.environ.get("REDIS_URL"):
+        # the server's cache is its own, it only notices once that expires
+        print(
+            f"Without REDIS_URL the server may show the setup screen for up to "
+            f"DISPLAY_CACHE_TIMEOUT ({settings.DISPLAY_CACHE_TIMEOUT}s)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=10,
+        help="Seconds between the polls of a device, shorter than a real "
+        "refresh rate to squeeze a fleet's load into a short run.",
+    )
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=50,
+        help="Requests in flight at most, raise it if polls start late.",
+    )
+    parser.add_argument("--log-every", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--owner", help="Username to claim the devices for.")
+    parser.add_argument("--seed", type=int, default=0)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    fleet = Fleet(args.url, args.interval, args.log_every, args.timeout)
+    # locally administered addresses, so they can't clash with real devices
+    devices = [
+        VirtualDevice(
+            ":".join(
+                f"{b:02X}" for b in (0x02, args.seed & 0xFF, *i.to_bytes(4, "big"))
+            )
+        )
+        for i in range(args.devices)
+    ]
+
+    print(f"Setting up {len(devices)} devices against {fleet.url}")
+    start_time = time.monotonic()
+    threads = [
+        threading.Thread(
+            target=lambda chunk: [fleet.setup(d) for d in chunk], args=(chunk,)
+        )
+        for chunk in (devices[i :: args.concurrency] for i in range(args.concurrency))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    setup_elapsed = time.monotonic() - start_time
+
+    if args.owner:
+        claim_devices(devices, args.owner)
+    missing = [device for device in devices if not device.api_key]
+    if missing:
+        print(
+            f"{len(missing)} device(s) got no API key and are left out, "
+            f"claimed ones are reused with --owner or a different --seed"
+        )
+        devices = [device for device in devices if device.api_key]
+    if not devices:
+        return 1
+
+    print(f"Polling every {args.interval}s for {args.duration}s\n")
+    elapsed = fleet.run(devices, args.duration, args.concurrency)
+
+    results = {"setup": summarize(fleet.samples["setup"], setup_elapsed)}
+    for kind in ("display", "image", "log"):
+        results[kind] = summarize(fleet.samples[kind], elapsed)
+    results["schedule lag"] = summarize(fleet.lag)
+
+    exit_code = finish(
+        args,
+        results,
+        {
+            key: getattr(args, key)
+            for key in ("url", "devices", "interval", "duration", "concurrency")
+        },
+    )
+    if fleet.errors:
+        print("\nErrors:")
+        for error, count in fleet.errors.most_common():
+            print(f"  {count:6d} {error}")
+    if results["schedule lag"]["p90_ms"] > args.interval * 100:
+        print("\nPolls started late, the numbers understate the load asked for")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
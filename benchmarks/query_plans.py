@@ -0,0 +1,213 @@
+"""
+Check that the queries behind the device endpoints use indexes at scale.
+
+Seeds a throwaway SQLite database with a realistic amount of history, then
+runs EXPLAIN QUERY PLAN and times each hot query. Exits non-zero if any of
+them scans a table or sorts without an index.
+
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --devices 1000 --screens 100000 --logs 100000
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def setup_django(db_file):
+    # settings read the database path from the environment
+    os.environ["DB_FILE"] = db_file
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "byos_django.settings")
+
+    import django
+
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def insert(cursor, model, rows):
+    """INSERT `rows`, dicts keyed by attname, in one executemany.
+
+    Much faster than bulk_create at this scale. Columns a row leaves out get
+    the field's default, so columns added to the models later don't break
+    the seed.
+    """
+    from django.db import connection
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    defaults = {field.attname: field.get_default() for field in fields}
+    cursor.executemany(
+        f"INSERT INTO {model._meta.db_table} ({columns}) VALUES ({placeholders})",
+        (
+            [
+                field.get_db_prep_save(
+                    row.get(field.attname, defaults[field.attname]), connection
+                )
+                for field in fields
+            ]
+            for row in rows
+        ),
+    )
+
+
+def seed(devices, screens, logs):
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    from trmnl.models import Device, DeviceLog, Screen
+
+    now = timezone.now()
+    rng = random.Random(0)
+
+    def random_string(alphabet, length):
+        return "".join(rng.choices(alphabet, k=length))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        insert(
+            cursor,
+            Device,
+            (
+                {
+                    "friendly_id": f"{i:06X}",
+                    "device_name": f"Device {i}",
+                    "mac_address": ":".join(f"{b:02X}" for b in i.to_bytes(6, "big")),
+                    "api_key": random_string(string.ascii_letters, 32),
+                    "created_at": now,
+                    "updated_at": now,
+                    "last_seen_at": now,
+                    "next_poll_at": now + timedelta(seconds=i % 3600),
+                    "plugin": "static_html" if i % 10 == 0 else "",
+                }
+                for i in range(devices)
+            ),
+        )
+        insert(
+            cursor,
+            Screen,
+            (
+                {
+                    "device_id": i % devices + 1,
+                    "html": f"<p>Screen {i}</p>",
+                    "image_hash": random_string("0123456789abcdef", 64),
+                    "created_at": now - timedelta(seconds=screens - i),
+                    "generated": i % 50 != 0,
+                    "status": "done" if i % 50 else "failed",
+                }
+                for i in range(screens)
+            ),
+        )
+        insert(
+            cursor,
+            DeviceLog,
+            (
+                {
+                    "device_id": i % devices + 1,
+                    "message": {"battery": 3.9},
+                    "created_at": now - timedelta(seconds=logs - i),
+                }
+                for i in range(logs)
+            ),
+        )
+        cursor.execute("ANALYZE")
+
+
+def hot_queries():
+    from django.utils import timezone
+
+    from trmnl.models import Device, DeviceLog, Screen
+    from trmnl.scheduler import prerender_candidates
+
+    device = Device.objects.order_by("?").first()
+    screen = Screen.objects.filter(device=device).order_by("?").first()
+
+    return {
+        "display: device": Device.objects.filter(
+            api_key=device.api_key, mac_address=device.mac_address
+        ),
+        "display: latest screen": Screen.objects.filter(device=device, generated=True)
+        .defer("html")
+        .order_by("-created_at")[:1],
+        "media: screen": Screen.objects.select_related("device").filter(
+            device__friendly_id=device.friendly_id, id=screen.id
+        ),
+        "log: device": Device.objects.filter(api_key=device.api_key),
+        "admin: device logs": DeviceLog.objects.filter(device=device).order_by(
+            "-created_at"
+        )[:50],
+        "worker: next job": Screen.objects.filter(status="queued").order_by(
+            "created_at"
+        )[:1],
+        "retention: screen cutoff": Screen.objects.filter(device=device, generated=True)
+        .order_by("-created_at")
+        .values_list("created_at", flat=True)[49:50],
+        "scheduler: due devices": prerender_candidates(timezone.now(), 120)[:50],
+        "retention: old logs": DeviceLog.objects.filter(
+            created_at__lt=timezone.now() - timedelta(days=30)
+        ).values_list("pk", flat=True)[:500],
+    }
+
+
+def check_plan(plan):
+    """Return the problems with a SQLite query plan, if any."""
+    problems = []
+    for line in plan.splitlines():
+        line = line.strip(" |-`")
+        if line.startswith("SCAN ") and " USING " not in line:
+            problems.append(f"full table scan: {line}")
+        if "USE TEMP B-TREE" in line:
+            problems.append(f"sort without an index: {line}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--screens", type=int, default=1_000_000)
+    parser.add_argument("--logs", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        setup_django(os.path.join(folder, "bench.sqlite3"))
+
+        start_time = time.time()
+        seed(args.devices, args.screens, args.logs)
+        print(
+            f"Seeded {args.devices} devices, {args.screens} screens and "
+            f"{args.logs} logs in {time.time() - start_time:.1f}s\n"
+        )
+
+        failures = 0
+        for name, queryset in hot_queries().items():
+            plan = queryset.explain()
+            start_time = time.perf_counter()
+            for _ in range(args.repeat):
+                list(queryset.all())
+            elapsed = (time.perf_counter() - start_time) / args.repeat * 1000
+
+            problems = check_plan(plan)
+            failures += bool(problems)
+            print(f"{'FAIL' if problems else 'ok':4} {name:28} {elapsed:8.3f}ms")
+            for line in plan.splitlines():
+                print(f"       {line}")
+            for problem in problems:
+                print(f"       ! {problem}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
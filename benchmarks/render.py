@@ -0,0 +1,181 @@
+"""
+Benchmark the stages that turn a screenshot into the BMP a TRMNL displays.
+
+Times decoding, each dither mode, encoding and diffing on a synthetic
+800x480 screenshot. With --browser real screenshots of the preview's base
+template are taken too, which needs Playwright and a browser (or PW_SERVER).
+
+    python benchmarks/render.py
+    python benchmarks/render.py --iterations 50 --save render-baseline.json
+    python benchmarks/render.py --browser --concurrency 4 --compare render-baseline.json
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from common import add_baseline_arguments, finish, summarize
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+WIDTH = 800
+HEIGHT = 480
+
+
+def synthetic_png(seed):
+    """An 8-bit RGB PNG with gradients, blocks and fine detail, like a screen
+    with images and text would have."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    gray = (x / WIDTH * 255 + np.sin(y / 12) * 40).clip(0, 255)
+    for _ in range(40):
+        top, left = rng.integers(0, HEIGHT - 40), rng.integers(0, WIDTH - 120)
+        gray[top : top + 12, left : left + 100] = rng.integers(0, 2) * 255
+    gray = (gray + rng.normal(0, 8, gray.shape)).clip(0, 255).astype(np.uint8)
+    rgb = np.repeat(gray[:, :, None], 3, axis=2)
+
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data)
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    scanlines = np.hstack(
+        [np.zeros((HEIGHT, 1), dtype=np.uint8), rgb.reshape(HEIGHT, WIDTH * 3)]
+    )
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", WIDTH, HEIGHT, 8, 2, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)),
+            chunk(b"IEND", b""),
+        ]
+    )
+
+
+def measure(func, iterations, warmup=2):
+    for _ in range(warmup):
+        func()
+    samples = []
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        sample_start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - sample_start)
+    return summarize(samples, time.perf_counter() - start_time)
+
+
+def measure_concurrently(func, iterations, concurrency):
+    def timed(_):
+        sample_start = time.perf_counter()
+        func()
+        return time.perf_counter() - sample_start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(timed, range(concurrency)))
+        start_time = time.perf_counter()
+        samples = list(executor.map(timed, range(iterations)))
+    return summarize(samples, time.perf_counter() - start_time)
+
+
+def benchmark_stages(png, iterations):
+    from trmnl.imaging import (
+        DITHER_MODES,
+        DITHERERS,
+        diff_bmp,
+        dither_png,
+        encode_bmp,
+        encode_png,
+        to_grayscale,
+    )
+
+    results = {"decode": measure(lambda: to_grayscale(png), iterations)}
+    gray = to_grayscale(png)
+    for mode in DITHER_MODES:
+        results[f"dither {mode}"] = measure(lambda: DITHERERS[mode](gray), iterations)
+
+    pixels = dither_png(png)
+    results["encode bmp"] = measure(lambda: encode_bmp(pixels), iterations)
+    results["encode png"] = measure(lambda: encode_png(pixels), iterations)
+
+    # a clock ticking over, and a whole screen changing
+    bmp = encode_bmp(pixels)
+    ticked = pixels.copy()
+    ticked[20:60, 700:780] = ~ticked[20:60, 700:780]
+    ticked_bmp = encode_bmp(ticked)
+    inverted_bmp = encode_bmp(~pixels)
+    results["diff small"] = measure(lambda: diff_bmp(bmp, ticked_bmp), iterations)
+    results["diff full"] = measure(lambda: diff_bmp(bmp, inverted_bmp), iterations)
+    return results
+
+
+def benchmark_browser(iterations, concurrency):
+    from django.conf import settings
+
+    from trmnl.rendering import _png_to_bmp, get_browser_pool
+    from trmnl.templating import base_html
+
+    html = base_html()
+    pool = get_browser_pool()
+
+    def render():
+        _png_to_bmp(pool.screenshot(html), settings.RENDER_DITHER)
+
+    # the render cache would make every render after the first free, so
+    # this goes around it
+    results = {
+        "screenshot": measure_concurrently(
+            lambda: pool.screenshot(html), iterations, concurrency
+        ),
+        "render": measure_concurrently(render, iterations, concurrency),
+    }
+    return results, pool.screenshot(html)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--browser", action="store_true", help="Also time real screenshots."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Screenshots taken at once with --browser.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "byos_django.settings")
+
+    import django
+
+    django.setup()
+
+    results = {}
+    png = synthetic_png(args.seed)
+    if args.browser:
+        browser_results, png = benchmark_browser(args.iterations, args.concurrency)
+        results.update(browser_results)
+    results.update(benchmark_stages(png, args.iterations))
+
+    return finish(
+        args,
+        results,
+        {
+            "iterations": args.iterations,
+            "browser": args.browser,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,15 +14,23 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
-from trmnl.routing import websocket_urlpatterns
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "byos_django.settings")
 
+# set up Django before importing anything that needs settings or models
+django_asgi_app = get_asgi_application()
+
+from trmnl.retention import retention_sweeper  # noqa: E402
+from trmnl.routing import websocket_urlpatterns  # noqa: E402
+from trmnl.scheduler import prerender_scheduler  # noqa: E402
+
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
+        "http": django_asgi_app,
         "websocket": AllowedHostsOriginValidator(
             AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
         ),
     }
 )
+
+retention_sweeper.start()
+prerender_scheduler.start()
@@ -84,6 +84,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+if os.environ.get("REDIS_URL"):
+    # shared between processes, e.g. the app and render workers
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -121,13 +141,162 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "static"
 
+# validated API keys are cached for API_KEY_CACHE_TIMEOUT seconds, invalid ones
+# for API_KEY_NEGATIVE_CACHE_TIMEOUT. With API_KEY_SHARED_CACHE (the default
+# with REDIS_URL) they are cached in the shared cache only, so revoking a key
+# takes effect in every process at once
+API_KEY_CACHE_TIMEOUT = int(os.environ.get("API_KEY_CACHE_TIMEOUT", 60))
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", 1000))
+API_KEY_NEGATIVE_CACHE_TIMEOUT = int(
+    os.environ.get("API_KEY_NEGATIVE_CACHE_TIMEOUT", 30)
+)
+API_KEY_NEGATIVE_CACHE_SIZE = int(os.environ.get("API_KEY_NEGATIVE_CACHE_SIZE", 10000))
+API_KEY_SHARED_CACHE = (
+    os.environ.get(
+        "API_KEY_SHARED_CACHE", "true" if os.environ.get("REDIS_URL") else "false"
+    ).lower()
+    == "true"
+)
+
+# /metrics requires an "Authorization: Bearer <METRICS_TOKEN>" header, and is
+# not served at all without a token
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# most screens accepted by one /api/v1/generate_screens request
+BATCH_MAX_SCREENS = int(os.environ.get("BATCH_MAX_SCREENS", 1000))
+
+# live preview sessions: at most PREVIEW_MAX_CONTEXTS users at once, each kept
+# PREVIEW_IDLE_TIMEOUT seconds after their last editor closes
+PREVIEW_MAX_CONTEXTS = int(os.environ.get("PREVIEW_MAX_CONTEXTS", 8))
+PREVIEW_IDLE_TIMEOUT = int(os.environ.get("PREVIEW_IDLE_TIMEOUT", 300))
+# least seconds between two renders of one preview connection
+PREVIEW_MIN_INTERVAL = float(os.environ.get("PREVIEW_MIN_INTERVAL", 0.25))
+
+# compiled screen templates kept in memory
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 100))
+
+# Rendered screens, stored by content hash
+# https://docs.djangoproject.com/en/5.1/topics/files/
+
+MEDIA_ROOT = Path(os.environ.get("MEDIA_ROOT", BASE_DIR / "media"))
+
+if os.environ.get("BLOB_STORE", "filesystem") == "s3":
+    BLOB_STORE = {
+        "BACKEND": "trmnl.storage.S3BlobStore",
+        "OPTIONS": {
+            "bucket": os.environ.get("S3_BUCKET"),
+            "prefix": os.environ.get("S3_PREFIX", "screens/"),
+            "endpoint_url": os.environ.get("S3_ENDPOINT_URL"),
+        },
+    }
+else:
+    BLOB_STORE = {
+        "BACKEND": "trmnl.storage.FileSystemBlobStore",
+        "OPTIONS": {"root": MEDIA_ROOT / "screens"},
+    }
+
+# when set, device images are sent by nginx through an X-Accel-Redirect to this
+# internal location, which must map onto the blob store root
+BLOB_STORE_ACCEL_PREFIX = os.environ.get("BLOB_STORE_ACCEL_PREFIX")
+
+# seconds a device and its latest screen are cached for /api/display/. Changes
+# made in this process invalidate it immediately, others (e.g. render workers)
+# only do so with a shared cache (REDIS_URL)
+DISPLAY_CACHE_TIMEOUT = int(os.environ.get("DISPLAY_CACHE_TIMEOUT", 60))
+# seconds between writes of buffered last seen / refresh counts, 0 writes on poll
+POLL_FLUSH_INTERVAL = int(os.environ.get("POLL_FLUSH_INTERVAL", 30))
+
+# device logs are buffered and written in batches; at most LOG_BUFFER_SIZE wait
+# in memory, LOG_FLUSH_INTERVAL=0 writes each one as it arrives
+LOG_BUFFER_SIZE = int(os.environ.get("LOG_BUFFER_SIZE", 10000))
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL = int(os.environ.get("LOG_FLUSH_INTERVAL", 5))
+
+# screen changes an adaptive refresh rate is worked out from
+ADAPTIVE_REFRESH_HISTORY = int(os.environ.get("ADAPTIVE_REFRESH_HISTORY", 20))
+
+# history kept by the retention sweeper and prune_history, 0 keeps everything
+RETENTION_SCREENS = int(os.environ.get("RETENTION_SCREENS", 50))
+RETENTION_LOG_DAYS = int(os.environ.get("RETENTION_LOG_DAYS", 30))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 500))
+# images stored this recently are kept even if no screen uses them, a render
+# may not have saved its screen yet
+RETENTION_BLOB_GRACE = int(os.environ.get("RETENTION_BLOB_GRACE", 600))
+# seconds between in-process sweeps, 0 leaves it to the prune_history command
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", 3600))
+# none, incremental (see prune_history --enable-incremental-vacuum) or full
+RETENTION_VACUUM = os.environ.get("RETENTION_VACUUM", "none")
+
+# devices with a plugin get their next screen rendered ahead of their predicted
+# next poll (last seen + refresh rate). The scheduler checks every
+# PRERENDER_INTERVAL seconds (0 leaves it to the prerender command) and renders
+# up to PRERENDER_BATCH_SIZE screens for devices due within PRERENDER_LEAD
+PRERENDER_INTERVAL = int(os.environ.get("PRERENDER_INTERVAL", 60))
+PRERENDER_LEAD = int(os.environ.get("PRERENDER_LEAD", 120))
+PRERENDER_BATCH_SIZE = int(os.environ.get("PRERENDER_BATCH_SIZE", 50))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # application specific
-PW_SERVER = os.environ.get("PW_SERVER")
+# Playwright servers to render on, comma separated, or a single PW_SERVER.
+# Without any, browsers are launched locally
+PW_SERVERS = [
+    url.strip()
+    for url in os.environ.get("PW_SERVERS", os.environ.get("PW_SERVER", "")).split(",")
+    if url.strip()
+]
+# least_loaded or round_robin, how new browsers are spread over the servers
+PW_SERVER_STRATEGY = os.environ.get("PW_SERVER_STRATEGY", "least_loaded")
+# renders this process runs on each server at once at most, 0 for no limit
+PW_SERVER_MAX_RENDERS = int(os.environ.get("PW_SERVER_MAX_RENDERS", 0))
+# seconds a server that failed is left alone
+PW_SERVER_RETRY_AFTER = int(os.environ.get("PW_SERVER_RETRY_AFTER", 30))
+# seconds between checks that the servers are reachable
+PW_SERVER_HEALTH_INTERVAL = int(os.environ.get("PW_SERVER_HEALTH_INTERVAL", 10))
+# warm browsers kept around for rendering screens
+RENDER_POOL_SIZE = int(os.environ.get("RENDER_POOL_SIZE", 2))
+# recycle a browser after this many renders
+RENDER_POOL_MAX_RENDERS = int(os.environ.get("RENDER_POOL_MAX_RENDERS", 100))
+# seconds to wait for a render before giving up
+RENDER_TIMEOUT = int(os.environ.get("RENDER_TIMEOUT", 60))
+# floyd_steinberg, ordered or threshold
+RENDER_DITHER = os.environ.get("RENDER_DITHER", "floyd_steinberg")
+# bytes of rendered screens kept in memory for reuse, 0 disables the cache
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 32 * 1024 * 1024))
+# hand renders to the render_worker command instead of rendering in the request
+RENDER_QUEUE = os.environ.get("RENDER_QUEUE", "false").lower() == "true"
+RENDER_WORKER_CONCURRENCY = int(
+    os.environ.get("RENDER_WORKER_CONCURRENCY", RENDER_POOL_SIZE)
+)
+RENDER_WORKER_POLL_INTERVAL = float(os.environ.get("RENDER_WORKER_POLL_INTERVAL", 1))
+# seconds before a job stuck in "rendering" is handed to another worker
+RENDER_JOB_TIMEOUT = int(os.environ.get("RENDER_JOB_TIMEOUT", 300))
+# seconds a render waits for the page's stylesheets, scripts, images and fonts
+# after the HTML itself has loaded, before taking the screenshot regardless
+RENDER_LOAD_TIMEOUT = float(os.environ.get("RENDER_LOAD_TIMEOUT", 5))
+
+# assets rendered pages load from ASSET_CACHE_HOSTS are served from a cache in
+# ASSET_CACHE_DIR (empty disables it), filled as screens use them or by the
+# warm_asset_cache command. With ASSET_CACHE_OFFLINE they are only ever served
+# from the cache. Requests to ASSET_BLOCK_HOSTS ("*" for every other host) are
+# refused. Hosts are comma separated and may contain wildcards
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", str(MEDIA_ROOT / "assets"))
+ASSET_CACHE_HOSTS = [
+    host.strip()
+    for host in os.environ.get(
+        "ASSET_CACHE_HOSTS", "usetrmnl.com,fonts.googleapis.com,fonts.gstatic.com"
+    ).split(",")
+    if host.strip()
+]
+ASSET_CACHE_OFFLINE = os.environ.get("ASSET_CACHE_OFFLINE", "false").lower() == "true"
+ASSET_BLOCK_HOSTS = [
+    host.strip()
+    for host in os.environ.get("ASSET_BLOCK_HOSTS", "").split(",")
+    if host.strip()
+]
 
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 
@@ -1,9 +1,15 @@
 import json
 
+from django import forms
+from django.conf import settings
 from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from django.urls import reverse
 from django.utils.safestring import mark_safe
 
-from .models import APIKey, Device, DeviceLog, Screen
+from .jobs import enqueue
+from .models import APIKey, Device, DeviceLog, Screen, ScreenTemplate
+from .plugins import plugin_choices
 
 
 class DeviceAdmin(admin.ModelAdmin):
@@ -12,6 +18,8 @@ class DeviceAdmin(admin.ModelAdmin):
         "device_name",
         "user",
         "refresh_rate",
+        "adaptive_refresh",
+        "plugin",
         "last_seen_at",
     )
     list_filter = ("user", "created_at")
@@ -21,9 +29,27 @@ class DeviceAdmin(admin.ModelAdmin):
     def has_add_permission(self, request, obj=None):
         return False
 
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        if db_field.name == "plugin":
+            return forms.ChoiceField(
+                choices=[("", "---------"), *plugin_choices()], required=False
+            )
+        return super().formfield_for_dbfield(db_field, request, **kwargs)
+
     def get_readonly_fields(self, request, obj=None):
-        # Make all fields read-only except device_name and user
-        editable_fields = {"device_name", "user", "refresh_rate"}
+        # Make all fields read-only except device_name, user and what it shows
+        editable_fields = {
+            "device_name",
+            "user",
+            "refresh_rate",
+            "adaptive_refresh",
+            "min_refresh_rate",
+            "max_refresh_rate",
+            "quiet_hours_start",
+            "quiet_hours_end",
+            "plugin",
+            "plugin_config",
+        }
         all_fields = {field.name for field in self.model._meta.fields}
         readonly_fields = all_fields - editable_fields
         return readonly_fields
@@ -49,37 +75,94 @@ class DeviceLogAdmin(admin.ModelAdmin):
 
 
 class ScreenAdmin(admin.ModelAdmin):
-    list_display = ("device", "created_at", "generated")
-    list_filter = ("device", "created_at", "generated")
+    list_display = ("device", "created_at", "generated", "status")
+    list_filter = ("device", "created_at", "generated", "status")
     search_fields = ("device", "html")
-    readonly_fields = ("created_at", "generated", "embed_image")
-    fields = ("device", "created_at", "generated", "html", "embed_image")
+    readonly_fields = (
+        "created_at",
+        "generated",
+        "status",
+        "error",
+        "changed_pixels",
+        "changed_regions",
+        "embed_image",
+    )
+    fields = (
+        "device",
+        "created_at",
+        "generated",
+        "status",
+        "error",
+        "changed_pixels",
+        "changed_regions",
+        "html",
+        "embed_image",
+    )
     actions = ["generate"]
 
     def embed_image(self, obj=None):
         result = ""
-        if obj and obj.generated:
-            result = f'<img src="{obj.image_as_base64}" alt="screen">'
+        image = obj.image_as_base64 if obj and obj.image_hash else None
+        if image:
+            result = f'<img src="{image}" alt="screen">'
         return mark_safe(result)
 
     embed_image.short_description = "Generated Image"
 
     def get_readonly_fields(self, request, obj=...):
         if obj and obj.generated:
-            return ["created_at", "generated", "html", "embed_image"]
-        return ["created_at", "generated", "embed_image"]
+            return [*self.readonly_fields, "html"]
+        return self.readonly_fields
 
     def generate(self, request, queryset):
         objs = queryset.filter(generated=False)
         obj: Screen
         for obj in objs:
-            obj.generate_screen()
+            if settings.RENDER_QUEUE:
+                enqueue(obj)
+            else:
+                obj.generate_screen()
 
     def save_model(self, request, obj, form, change):
         if not obj.generated:
-            obj.generate_screen()
+            if settings.RENDER_QUEUE:
+                obj.status = Screen.Status.QUEUED
+                self.message_user(
+                    request,
+                    "The screen has been queued and will be rendered shortly.",
+                    level=messages.INFO,
+                )
+            elif not change:
+                # saved by generate_new_screen, unless it came out unchanged
+                if obj.generate_new_screen() is not obj:
+                    self.message_user(
+                        request,
+                        "The screen looks just like the device's current one, "
+                        "so it wasn't added.",
+                        level=messages.INFO,
+                    )
+                return
+            else:
+                obj.generate_screen()
         super().save_model(request, obj, form, change)
 
+    def response_add(self, request, obj, post_url_continue=None):
+        if obj.pk is None:
+            # not added, as it was unchanged
+            return HttpResponseRedirect(
+                reverse(
+                    "admin:trmnl_screen_changelist", current_app=self.admin_site.name
+                )
+            )
+        return super().response_add(request, obj, post_url_continue)
+
+
+class ScreenTemplateAdmin(admin.ModelAdmin):
+    list_display = ("name", "user", "updated_at")
+    list_filter = ("user",)
+    search_fields = ("name", "body")
+    readonly_fields = ("created_at", "updated_at")
+
 
 class APIKeyAdmin(admin.ModelAdmin):
     list_display = ("user", "name", "created_at")
@@ -102,4 +185,5 @@ class APIKeyAdmin(admin.ModelAdmin):
 admin.site.register(Device, DeviceAdmin)
 admin.site.register(DeviceLog, DeviceLogAdmin)
 admin.site.register(Screen, ScreenAdmin)
+admin.site.register(ScreenTemplate, ScreenTemplateAdmin)
 admin.site.register(APIKey, APIKeyAdmin)
@@ -5,3 +5,6 @@ class TrmnlConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "trmnl"
     verbose_name = "TRMNL"
+
+    def ready(self):
+        from . import signals  # noqa: F401
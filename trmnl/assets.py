@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import urllib.request
+from fnmatch import fnmatch
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from playwright.sync_api import Error as PlaywrightError
+
+from .metrics import Counter
+from .storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+CACHE = "cache"
+BLOCK = "block"
+CONTINUE = "continue"
+# what became of a request for a cacheable asset
+HIT = "hit"
+MISSING = "missing"
+FETCH = "fetch"
+
+# the asset_requests_total result each outcome is counted as
+RESULTS = {BLOCK: "blocked", HIT: "hit", MISSING: "missing", FETCH: "miss"}
+# why the outcomes that fail a request do so
+ABORT_REASONS = {BLOCK: "blockedbyclient", MISSING: "internetdisconnected"}
+
+# Google Fonts serves different CSS to each browser, fetch what Firefox gets
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:134.0) Gecko/20100101 Firefox/134.0"
+# headers worth keeping with a cached asset
+KEPT_HEADERS = ("content-type", "access-control-allow-origin")
+
+HTML_ASSET = re.compile(r"""(?:src|href)\s*=\s*["'](https?://[^"']+)["']""")
+CSS_ASSET = re.compile(
+    r"""url\(\s*["']?([^"')]+)["']?\s*\)|@import\s+["']([^"']+)["']"""
+)
+
+asset_requests_total = Counter(
+    "trmnl_asset_requests_total",
+    "Requests made while rendering, by what was done with them.",
+    ["result"],
+)
+
+
+class AssetCache:
+    """Assets fetched by rendered pages, kept on disk by URL."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, url):
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def get(self, url):
+        """Return the body and headers cached for `url`, or None."""
+        path = self.path(url)
+        try:
+            body = path.with_suffix(".body").read_bytes()
+            meta = json.loads(path.with_suffix(".json").read_text())
+        except FileNotFoundError:
+            return None
+        return body, meta["headers"]
+
+    def put(self, url, body, headers):
+        path = self.path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        headers = {
+            name.lower(): value
+            for name, value in headers.items()
+            if name.lower() in KEPT_HEADERS
+        }
+        # the body goes first, an entry only counts once its metadata exists
+        write_atomic(path.with_suffix(".body"), body)
+        write_atomic(
+            path.with_suffix(".json"),
+            json.dumps({"url": url, "headers": headers}).encode(),
+        )
+
+
+def _matches(host, patterns):
+    return any(fnmatch(host, pattern) for pattern in patterns)
+
+
+def asset_action(url):
+    """What to do with a request a rendered page makes.
+
+    Assets from ASSET_CACHE_HOSTS are served from the cache, those from
+    ASSET_BLOCK_HOSTS are refused and the rest go out as usual.
+    """
+    if not url.startswith(("http://", "https://")):
+        return CONTINUE
+    host = urlsplit(url).hostname or ""
+    if settings.ASSET_CACHE_DIR and _matches(host, settings.ASSET_CACHE_HOSTS):
+        return CACHE
+    if _matches(host, settings.ASSET_BLOCK_HOSTS):
+        return BLOCK
+    return CONTINUE
+
+
+def routing_enabled():
+    """Whether rendered pages' requests need to go through route_asset."""
+    caching = settings.ASSET_CACHE_DIR and settings.ASSET_CACHE_HOSTS
+    return bool(caching or settings.ASSET_BLOCK_HOSTS)
+
+
+def get_asset_cache():
+    return AssetCache(settings.ASSET_CACHE_DIR)
+
+
+def _fulfill_args(cached):
+    body, headers = cached
+    return {
+        "status": 200,
+        "headers": {"access-control-allow-origin": "*", **headers},
+        "body": body,
+    }
+
+
+def _outcome(action, cached):
+    """Turn the action for a request into what is done with it, given the
+    cache entry for a cacheable one, and count it.
+    """
+    if action == CACHE:
+        if cached is not None:
+            action = HIT
+        else:
+            action = MISSING if settings.ASSET_CACHE_OFFLINE else FETCH
+    if action in RESULTS:
+        asset_requests_total.inc(result=RESULTS[action])
+    return action
+
+
+def route_asset(route):
+    """Playwright route handler serving assets from the cache.
+
+    A cache miss is fetched and cached, unless ASSET_CACHE_OFFLINE is set,
+    so the cache fills up with whatever screens use.
+    """
+    url = route.request.url
+    action = asset_action(url)
+    cache = cached = None
+    if action == CACHE:
+        cache = get_asset_cache()
+        cached = cache.get(url)
+    outcome = _outcome(action, cached)
+
+    if outcome == CONTINUE:
+        route.continue_()
+    elif outcome in ABORT_REASONS:
+        route.abort(ABORT_REASONS[outcome])
+    elif outcome == HIT:
+        route.fulfill(**_fulfill_args(cached))
+    else:
+        try:
+            response = route.fetch()
+            body = response.body()
+        except PlaywrightError:
+            # an unhandled route would hang the page until it times out
+            route.abort("failed")
+            return
+        if response.ok:
+            cache.put(url, body, response.headers)
+        route.fulfill(response=response, body=body)
+
+
+async def aroute_asset(route):
+    """The async counterpart of route_asset."""
+    url = route.request.url
+    action = asset_action(url)
+    cache = cached = None
+    if action == CACHE:
+        cache = get_asset_cache()
+        # off the event loop, the other renders' pages wait on it
+        cached = await asyncio.to_thread(cache.get, url)
+    outcome = _outcome(action, cached)
+
+    if outcome == CONTINUE:
+        await route.continue_()
+    elif outcome in ABORT_REASONS:
+        await route.abort(ABORT_REASONS[outcome])
+    elif outcome == HIT:
+        await route.fulfill(**_fulfill_args(cached))
+    else:
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except PlaywrightError:
+            await route.abort("failed")
+            return
+        if response.ok:
+            await asyncio.to_thread(cache.put, url, body, response.headers)
+        await route.fulfill(response=response, body=body)
+
+
+def find_assets(html):
+    """URLs of the assets in `html` that would be served from the cache."""
+    return [url for url in HTML_ASSET.findall(html) if asset_action(url) == CACHE]
+
+
+def warm(urls, refresh=False, timeout=30):
+    """Fetch `urls` into the cache, along with the fonts and images their
+    stylesheets use. Returns the URLs cached and those that failed.
+    """
+    cache = get_asset_cache()
+    cached, failed = [], []
+    pending = list(dict.fromkeys(urls))
+    seen = set(pending)
+    while pending:
+        url = pending.pop(0)
+        entry = None if refresh else cache.get(url)
+        if entry is None:
+            request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    entry = response.read(), dict(response.headers)
+            except OSError as e:
+                logger.warning("Couldn't fetch %s: %s", url, e)
+                failed.append(url)
+                continue
+            cache.put(url, *entry)
+            cached.append(url)
+
+        body, headers = entry
+        content_type = {name.lower(): value for name, value in headers.items()}.get(
+            "content-type", ""
+        )
+        if content_type.startswith("text/css"):
+            for match in CSS_ASSET.findall(body.decode(errors="replace")):
+                asset_url = urljoin(url, match[0] or match[1])
+                if asset_url not in seen and asset_action(asset_url) == CACHE:
+                    seen.add(asset_url)
+                    pending.append(asset_url)
+    return cached, failed
@@ -0,0 +1,70 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import TTLCache
+from .models import APIKey
+
+# validated keys with their user, and recently seen invalid keys, when there is
+# no shared cache. Changes made in this process invalidate them at once, others
+# only when the timeout is up
+valid_keys = TTLCache(settings.API_KEY_CACHE_SIZE, settings.API_KEY_CACHE_TIMEOUT)
+invalid_keys = TTLCache(
+    settings.API_KEY_NEGATIVE_CACHE_SIZE, settings.API_KEY_NEGATIVE_CACHE_TIMEOUT
+)
+
+# cached in the shared cache in place of an invalid key
+INVALID = "invalid"
+
+
+def _digest(key):
+    # keys are secrets, keep them out of cache keys
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _shared_key(digest):
+    return f"trmnl:api_key:{digest}"
+
+
+async def _aget_shared_api_key(key, digest):
+    shared_key = _shared_key(digest)
+    api_key = await cache.aget(shared_key)
+    if api_key is None:
+        api_key = await APIKey.objects.select_related("user").filter(key=key).afirst()
+        if api_key is None:
+            await cache.aset(
+                shared_key, INVALID, settings.API_KEY_NEGATIVE_CACHE_TIMEOUT
+            )
+            return None
+        await cache.aset(shared_key, api_key, settings.API_KEY_CACHE_TIMEOUT)
+    return None if api_key == INVALID else api_key
+
+
+async def aget_api_key(key):
+    """Return the APIKey for `key`, with its user loaded, or None."""
+    digest = _digest(key)
+    if settings.API_KEY_SHARED_CACHE:
+        # every process sees a change to the shared cache at once, so no
+        # local copy that would outlive a revoked key
+        return await _aget_shared_api_key(key, digest)
+
+    api_key = valid_keys.get(digest)
+    if api_key is not None:
+        return api_key
+    if digest in invalid_keys:
+        return None
+    api_key = await APIKey.objects.select_related("user").filter(key=key).afirst()
+    if api_key is None:
+        invalid_keys.set(digest, True)
+        return None
+    valid_keys.set(digest, api_key)
+    return api_key
+
+
+def invalidate_api_key(key):
+    digest = _digest(key)
+    valid_keys.delete(digest)
+    invalid_keys.delete(digest)
+    if settings.API_KEY_SHARED_CACHE:
+        cache.delete(_shared_key(digest))
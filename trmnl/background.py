@@ -0,0 +1,70 @@
+import atexit
+import logging
+import threading
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run `func` every `interval` seconds on a daemon thread.
+
+    With `run_at_exit` the task also runs one last time when the process
+    exits, for tasks that flush buffered state. `trigger` runs it early.
+    """
+
+    def __init__(self, func, interval, name=None, run_at_exit=False):
+        self.func = func
+        self.interval = interval
+        self.name = name or func.__name__
+        self.run_at_exit = run_at_exit
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running or not self.interval:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True
+            )
+            self._thread.start()
+            if self.run_at_exit:
+                atexit.register(self.stop)
+
+    def trigger(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.run_at_exit:
+            self.run_once()
+
+    def run_once(self):
+        try:
+            self.func()
+        except Exception:
+            logger.exception("Background task %s failed", self.name)
+        finally:
+            # connections are per thread, don't leave this one's lying around
+            connections.close_all()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.run_once()
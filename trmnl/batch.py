@@ -0,0 +1,61 @@
+from asgiref.sync import sync_to_async
+
+from .models import Screen
+from .polling import invalidate_latest_screen
+from .refresh import invalidate_refresh_rate
+from .rendering import arender_html
+
+
+async def _create_screens(screens):
+    screens = await Screen.objects.abulk_create(screens)
+    # bulk_create sends no post_save, so do what the signal handler would
+    for screen in screens:
+        invalidate_latest_screen(screen.device_id)
+        invalidate_refresh_rate(screen.device_id)
+    return screens
+
+
+async def aqueue_screens(html, devices):
+    """Queue one screen of `html` for each of `devices`."""
+    screens = await _create_screens(
+        [
+            Screen(device=device, html=html, status=Screen.Status.QUEUED)
+            for device in devices
+        ]
+    )
+    return [(screen, False) for screen in screens]
+
+
+async def arender_screens(html, devices):
+    """Render `html` once and give each of `devices` a screen showing it.
+
+    Returns a (screen, unchanged) pair per device. A device whose current
+    screen looks exactly the same gets no new screen, its current one comes
+    back instead. If rendering fails the screens are created as failed, with
+    the error.
+    """
+    try:
+        bmp = await arender_html(html)
+    except Exception as e:
+        screens = [
+            Screen(device=device, html=html, status=Screen.Status.FAILED, error=str(e))
+            for device in devices
+        ]
+        return [(screen, False) for screen in await _create_screens(screens)]
+
+    def compare():
+        results = []
+        for device in devices:
+            screen = Screen(device=device, html=html)
+            previous = screen.previous_screen()
+            screen.apply_render(bmp, previous)
+            if screen.status == Screen.Status.UNCHANGED:
+                previous.device = device
+                results.append((previous, True))
+            else:
+                results.append((screen, False))
+        return results
+
+    results = await sync_to_async(compare)()
+    await _create_screens([screen for screen, unchanged in results if not unchanged])
+    return results
@@ -0,0 +1,204 @@
+import itertools
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .background import PeriodicTask
+from .metrics import Collected
+
+logger = logging.getLogger(__name__)
+
+LEAST_LOADED = "least_loaded"
+ROUND_ROBIN = "round_robin"
+
+
+class NoBrowserServer(Exception):
+    pass
+
+
+class BrowserServer:
+    """A Playwright server, and this process's browsers and renders on it."""
+
+    def __init__(self, url, max_renders=0):
+        self.url = url
+        self.max_renders = max_renders
+        self.browsers = 0
+        self.renders = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    @property
+    def up(self):
+        return self.down_until <= time.monotonic()
+
+    @property
+    def full(self):
+        return bool(self.max_renders) and self.renders >= self.max_renders
+
+    def __str__(self):
+        return self.url
+
+
+class BrowserServers:
+    """The Playwright servers browsers are spread over.
+
+    Every browser connected to a server is leased from here and released
+    when it closes, so each server's load is known. A new browser goes to
+    the least loaded server, or to the next in turn with round robin.
+
+    Each render takes one of its server's slots for as long as it runs, so
+    at most `max_renders` run on a server at once, whichever pool their
+    browsers belong to. Warm browsers sitting idle don't take a slot.
+
+    A server that fails is skipped for `retry_after` seconds and its
+    browsers are relaunched elsewhere. The health check probes every server
+    in the background, so one that went away stops getting browsers before
+    a render runs into it, and one that came back gets them again.
+    """
+
+    def __init__(self, urls, strategy=LEAST_LOADED, max_renders=0, retry_after=30):
+        if strategy not in (LEAST_LOADED, ROUND_ROBIN):
+            raise ValueError(f"Unknown browser server strategy: {strategy}")
+        self.servers = [BrowserServer(url, max_renders) for url in urls]
+        self.strategy = strategy
+        self.retry_after = retry_after
+        self._turn = itertools.count()
+        self._changed = threading.Condition()
+
+    def __bool__(self):
+        return bool(self.servers)
+
+    def _pick(self, exclude):
+        candidates = [
+            server for server in self.servers if server not in exclude and server.up
+        ]
+        if not candidates:
+            return None
+        if self.strategy == ROUND_ROBIN:
+            return candidates[next(self._turn) % len(candidates)]
+        return min(candidates, key=lambda server: (server.full, server.browsers))
+
+    def acquire(self, exclude=()):
+        """Lease a server for a new browser.
+
+        Raises NoBrowserServer if none is up.
+        """
+        with self._changed:
+            server = self._pick(exclude)
+            if server is None:
+                raise NoBrowserServer("No browser server is up")
+            server.browsers += 1
+            return server
+
+    def release(self, server, failed=False):
+        """Give back a lease, `failed` if the browser lost its server."""
+        with self._changed:
+            server.browsers -= 1
+            if failed:
+                self._mark_down(server)
+            self._changed.notify_all()
+
+    def _mark_down(self, server):
+        if server.up:
+            logger.warning("Browser server %s is down", server)
+            server.failures += 1
+        server.down_until = time.monotonic() + self.retry_after
+
+    def try_start_render(self, server):
+        """Take one of `server`'s render slots if one is free."""
+        with self._changed:
+            if server.full:
+                return False
+            server.renders += 1
+            return True
+
+    def start_render(self, server, timeout=None):
+        """Take one of `server`'s render slots, waiting up to `timeout`
+        seconds for one. Raises NoBrowserServer if none frees up in time.
+        """
+        with self._changed:
+            if not self._changed.wait_for(lambda: not server.full, timeout):
+                raise NoBrowserServer(f"Browser server {server} is busy")
+            server.renders += 1
+
+    def end_render(self, server):
+        with self._changed:
+            server.renders -= 1
+            self._changed.notify_all()
+
+    def check_health(self, timeout=5):
+        """Probe whether each server accepts connections."""
+        for server in self.servers:
+            url = urlsplit(server.url)
+            port = url.port or (443 if url.scheme == "wss" else 80)
+            try:
+                socket.create_connection((url.hostname, port), timeout).close()
+            except OSError:
+                with self._changed:
+                    self._mark_down(server)
+                continue
+            with self._changed:
+                if not server.up:
+                    logger.info("Browser server %s is back up", server)
+                    server.down_until = 0.0
+                    self._changed.notify_all()
+
+
+_browser_servers = None
+_browser_servers_lock = threading.Lock()
+
+
+def get_browser_servers():
+    global _browser_servers
+    with _browser_servers_lock:
+        if _browser_servers is None:
+            _browser_servers = BrowserServers(
+                settings.PW_SERVERS,
+                strategy=settings.PW_SERVER_STRATEGY,
+                max_renders=settings.PW_SERVER_MAX_RENDERS,
+                retry_after=settings.PW_SERVER_RETRY_AFTER,
+            )
+            if _browser_servers:
+                health_check.start()
+        return _browser_servers
+
+
+def run_health_check():
+    get_browser_servers().check_health()
+
+
+health_check = PeriodicTask(
+    run_health_check,
+    settings.PW_SERVER_HEALTH_INTERVAL,
+    name="browser-server-health",
+)
+
+Collected(
+    "trmnl_browser_server_browsers",
+    "Browsers this process has open on each Playwright server.",
+    lambda: {(s.url,): s.browsers for s in get_browser_servers().servers},
+    labelnames=["server"],
+)
+Collected(
+    "trmnl_browser_server_renders",
+    "Renders this process is running on each Playwright server.",
+    lambda: {(s.url,): s.renders for s in get_browser_servers().servers},
+    labelnames=["server"],
+)
+Collected(
+    "trmnl_browser_server_up",
+    "Whether each Playwright server is taking browsers.",
+    lambda: {(s.url,): int(s.up) for s in get_browser_servers().servers},
+    labelnames=["server"],
+)
+Collected(
+    "trmnl_browser_server_failures_total",
+    "Times each Playwright server was found down.",
+    lambda: {(s.url,): s.failures for s in get_browser_servers().servers},
+    type="counter",
+    labelnames=["server"],
+)
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe LRU cache bounded by the total size of its values.
+
+    `sizeof` measures a value, by default its length, so a cache of bytes is
+    bounded in bytes. Hits and misses are counted for monitoring.
+    """
+
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            # would evict everything and still not fit
+            return
+        with self._lock:
+            if key in self._data:
+                self.size -= self.sizeof(self._data.pop(key))
+            self._data[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self.size -= self.sizeof(self._data.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class TTLCache(LRUCache):
+    """An LRU cache of at most `max_entries` entries that expire after
+    `timeout` seconds.
+    """
+
+    _missing = object()
+
+    def __init__(self, max_entries, timeout):
+        super().__init__(max_entries, sizeof=lambda entry: 1)
+        self.timeout = timeout
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            with self._lock:
+                # count it as the miss it is
+                self.hits -= 1
+                self.misses += 1
+            self.delete(key)
+            return default
+        return value
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic() + self.timeout, value))
@@ -1,82 +1,130 @@
+import asyncio
 import base64
 import json
-import shutil
-import tempfile
+import logging
+import struct
 import time
 
 from channels.generic.websocket import AsyncWebsocketConsumer
-from playwright.async_api import async_playwright
-from wand.image import Image
+from django.conf import settings
 
-from byos_django import settings
+from .imaging import dither_png, encode_bmp, encode_png
+from .rendering import PreviewBusy, get_preview_pool
+
+logger = logging.getLogger(__name__)
+
+# Asking for a "bmp" or "png" format gets the image back as a binary frame:
+# this header (version, format, seq, render time, wait time, stale edits
+# skipped; network byte order) followed by the image itself.
+FRAME_HEADER = struct.Struct("!BBIffH")
+FRAME_VERSION = 1
+FRAME_FORMATS = {"bmp": 1, "png": 2}
+ENCODERS = {"bmp": encode_bmp, "png": encode_png}
 
 
 class PreviewConsumer(AsyncWebsocketConsumer):
+    """Renders the live preview editor's HTML.
+
+    Only the newest HTML matters: an edit arriving while an older one is
+    still waiting or rendering cancels it, and renders start at most every
+    PREVIEW_MIN_INTERVAL seconds, so the preview keeps up with typing.
+    """
+
+    session = None
+    render_task = None
+
     async def connect(self):
         if not self.scope["user"].is_superuser:
             await self.close(reason="Unauthorized")
-        self.pw_manager = async_playwright()
-        self.pw = await self.pw_manager.__aenter__()
-        if settings.PW_SERVER:
-            self.browser = await self.pw.firefox.connect(ws_endpoint=settings.PW_SERVER)
-        else:
-            self.browser = await self.pw.firefox.launch(
-                headless=True,
-                args=["--window-size=800,480", "--disable-web-security"],
-            )
-        self.page = await self.browser.new_page()
-        await self.page.set_viewport_size({"width": 800, "height": 480})
+            return
+        try:
+            # a warm session is reused, so reconnects don't start a browser
+            self.session = await get_preview_pool().acquire(self.scope["user"].pk)
+        except PreviewBusy as e:
+            await self.close(reason=str(e))
+            return
+        self.next_render_at = 0
+        self.skipped = 0
         await self.accept()
 
     async def disconnect(self, close_code):
-        await self.page.close()
-        self.page = None
-        await self.browser.close()
-        self.pw = None
-        await self.pw_manager.__aexit__()
-        pass
+        if self.render_task is not None:
+            self.render_task.cancel()
+        if self.session is not None:
+            get_preview_pool().release(self.session)
+            self.session = None
 
     async def receive(self, text_data=None, bytes_data=None) -> None:
         text_data_json = json.loads(text_data)
-        await self.send(
-            text_data=json.dumps(await self.generate(text_data_json.get("html", None)))
+        if self.render_task is not None and not self.render_task.done():
+            # superseded before it was shown, don't spend more time on it
+            self.render_task.cancel()
+            self.skipped += 1
+        self.render_task = asyncio.create_task(
+            self.render(
+                text_data_json.get("html"),
+                text_data_json.get("seq"),
+                text_data_json.get("format"),
+            )
         )
 
-    async def generate(self, html):
-        start_time = time.time()
-        if not html:
-            return {"content": ""}
+    async def render(self, html, seq, image_format=None):
+        received_at = time.monotonic()
+        # wait out the rate limit, a newer edit may well cancel us meanwhile
+        await asyncio.sleep(max(0, self.next_render_at - received_at))
+        self.next_render_at = time.monotonic() + settings.PREVIEW_MIN_INTERVAL
+
+        start_time = time.monotonic()
+        binary = image_format in FRAME_FORMATS
+        try:
+            image = await self.generate(html, image_format if binary else "bmp")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Preview render failed")
+            await self.send(text_data=json.dumps({"seq": seq, "error": str(e)}))
+            return
+        render_time = time.monotonic() - start_time
+        wait_time = start_time - received_at
+        skipped, self.skipped = self.skipped, 0
 
-        # get random file name
-        folder = tempfile.mkdtemp()
+        if binary and image:
+            header = FRAME_HEADER.pack(
+                FRAME_VERSION,
+                FRAME_FORMATS[image_format],
+                int(seq or 0) % 2**32,
+                render_time,
+                wait_time,
+                min(skipped, 2**16 - 1),
+            )
+            await self.send(bytes_data=header + image)
+            return
 
-        await self.page.set_content(html)
-        await self.page.evaluate(
-            'document.getElementsByTagName("html")[0].style.overflow = "hidden";'
-            'document.getElementsByTagName("body")[0].style.overflow = "hidden";'
+        content = f"data:image/bmp;base64,{base64.b64encode(image).decode()}"
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "content": content if image else "",
+                    "seq": seq,
+                    "render_time": render_time,
+                    "wait_time": wait_time,
+                    "skipped": skipped,
+                }
+            )
         )
-        await self.page.screenshot(path=f"/{folder}/screen.png")
-
-        with Image(filename=f"/{folder}/screen.png") as img:
-            img.posterize(2, dither="floyd_steinberg")
-            amap = Image(width=img.width, height=img.height, pseudo="pattern:gray50")
-            amap.composite(img, 0, 0)
-            img = amap
-            img.quantize(2, colorspace_type="gray")
-            img.depth = 1
-            img.strip()
-            img.save(filename=f"bmp3:/{folder}/screen.bmp")
-
-        with open(f"/{folder}/screen.bmp", "rb") as f:
-            # base64
-            screen = f"data:image/bmp;base64,{base64.b64encode(f.read()).decode()}"
-
-        # clean up
-        shutil.rmtree(folder, ignore_errors=True)
-
-        return (
-            {
-                "content": screen,
-                "render_time": time.time() - start_time,
-            },
+
+    async def generate(self, html, image_format):
+        if not html:
+            return b""
+
+        if self.session.closed:
+            # the shared browser went away, get a session in a new one
+            pool = get_preview_pool()
+            pool.release(self.session)
+            self.session = None
+            self.session = await pool.acquire(self.scope["user"].pk)
+        png = await self.session.screenshot(html)
+        # dithering is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(
+            lambda: ENCODERS[image_format](dither_png(png, settings.RENDER_DITHER))
         )
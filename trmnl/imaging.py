@@ -0,0 +1,225 @@
+import struct
+import zlib
+
+import numpy as np
+from wand.image import Image
+
+DITHER_FLOYD_STEINBERG = "floyd_steinberg"
+DITHER_ORDERED = "ordered"
+DITHER_THRESHOLD = "threshold"
+DITHER_MODES = (DITHER_FLOYD_STEINBERG, DITHER_ORDERED, DITHER_THRESHOLD)
+
+# ITU-R BT.601 luma weights, the same ones ImageMagick uses for "gray"
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# black for 0 bits, white for 1 bits (BGRA)
+BMP_PALETTE = b"\x00\x00\x00\x00\xff\xff\xff\x00"
+
+
+def _bayer_matrix(size):
+    matrix = np.array([[0, 2], [3, 1]])
+    while matrix.shape[0] < size:
+        matrix = np.block(
+            [[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]]
+        )
+    # spread the thresholds evenly over 0..255
+    return ((matrix + 0.5) * 256 / matrix.size).astype(np.float32)
+
+
+BAYER_8 = _bayer_matrix(8)
+
+# precision, in pixels, of the changed regions found by diff_bmp
+DIFF_TILE = 16
+
+
+def to_grayscale(png):
+    """Decode PNG bytes into a 2D float32 array of luma values (0-255)."""
+    with Image(blob=png) as img:
+        img.depth = 8
+        width, height = img.width, img.height
+        rgb = np.frombuffer(img.make_blob("rgb"), dtype=np.uint8)
+    return rgb.reshape(height, width, 3) @ LUMA
+
+
+def threshold(gray):
+    return gray >= 128
+
+
+def ordered_dither(gray):
+    height, width = gray.shape
+    tiles = (-(-height // 8), -(-width // 8))
+    return gray >= np.tile(BAYER_8, tiles)[:height, :width]
+
+
+def floyd_steinberg(gray):
+    """Floyd-Steinberg error diffusion, vectorized along wavefronts.
+
+    A pixel only receives error from its left neighbour and the three pixels
+    above it, so every pixel with the same ``x + 2y`` can be quantized at once.
+    That turns width * height scalar steps into width + 2 * height array ones.
+    """
+    height, width = gray.shape
+    # work on a flat buffer padded by one column on each side and one row
+    # below, so error spilling off the edges has somewhere to go
+    stride = width + 2
+    buf = np.zeros((height + 1) * stride, dtype=np.float32)
+    buf.reshape(height + 1, stride)[:height, 1 : width + 1] = gray
+    out = np.zeros((height + 1) * stride, dtype=bool)
+    # (y, x) lives at y * stride + x + 1, so on wavefront t = x + 2y the
+    # index is y * (stride - 2) + t + 1
+    row_offsets = np.arange(height) * (stride - 2)
+
+    for t in range(width + 2 * (height - 1)):
+        first = max(0, (t - width + 2) // 2)
+        last = min(height - 1, t // 2)
+        idx = row_offsets[first : last + 1] + (t + 1)
+        values = buf[idx]
+        white = values >= 128
+        out[idx] = white
+        error = values - white * np.float32(255)
+        buf[idx + 1] += error * np.float32(7 / 16)
+        idx += stride
+        buf[idx - 1] += error * np.float32(3 / 16)
+        buf[idx] += error * np.float32(5 / 16)
+        buf[idx + 1] += error * np.float32(1 / 16)
+
+    return out.reshape(height + 1, stride)[:height, 1 : width + 1]
+
+
+DITHERERS = {
+    DITHER_FLOYD_STEINBERG: floyd_steinberg,
+    DITHER_ORDERED: ordered_dither,
+    DITHER_THRESHOLD: threshold,
+}
+
+
+def encode_bmp(pixels):
+    """Encode a 2D boolean array (True is white) as a 1-bit BMP."""
+    height, width = pixels.shape
+    rows = np.packbits(pixels, axis=1)
+    # BMP rows are padded to 4 bytes and stored bottom-up
+    stride = -(-rows.shape[1] // 4) * 4
+    if stride != rows.shape[1]:
+        rows = np.pad(rows, ((0, 0), (0, stride - rows.shape[1])))
+    data = rows[::-1].tobytes()
+
+    offset = 14 + 40 + len(BMP_PALETTE)
+    file_header = struct.pack("<2sIHHI", b"BM", offset + len(data), 0, 0, offset)
+    info_header = struct.pack(
+        "<IiiHHIIiiII", 40, width, height, 1, 1, 0, len(data), 2835, 2835, 2, 2
+    )
+    return file_header + info_header + BMP_PALETTE + data
+
+
+def decode_bmp(bmp):
+    """Return the packed rows (top first) and width of a 1-bit BMP."""
+    (offset,) = struct.unpack_from("<I", bmp, 10)
+    width, height = struct.unpack_from("<ii", bmp, 18)
+    stride = -(-width // 32) * 4
+    rows = np.frombuffer(
+        bmp, dtype=np.uint8, count=stride * abs(height), offset=offset
+    ).reshape(abs(height), stride)
+    # a positive height means the rows are stored bottom-up
+    return (rows[::-1] if height > 0 else rows), width
+
+
+def _regions(tiles):
+    """Bounding boxes, in tiles, of the connected groups of True tiles."""
+    regions = []
+    seen = np.zeros_like(tiles)
+    for y, x in zip(*np.nonzero(tiles)):
+        if seen[y, x]:
+            continue
+        seen[y, x] = True
+        top, left, bottom, right = y, x, y, x
+        stack = [(y, x)]
+        while stack:
+            cy, cx = stack.pop()
+            top, left = min(top, cy), min(left, cx)
+            bottom, right = max(bottom, cy), max(right, cx)
+            for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                if (
+                    0 <= ny < tiles.shape[0]
+                    and 0 <= nx < tiles.shape[1]
+                    and tiles[ny, nx]
+                    and not seen[ny, nx]
+                ):
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        regions.append((int(top), int(left), int(bottom), int(right)))
+    return regions
+
+
+def diff_bmp(old, new, tile=DIFF_TILE):
+    """Compare two 1-bit BMPs by XOR-ing their packed bits.
+
+    Returns the number of changed pixels and the bounding boxes, as
+    [x, y, width, height], of the changed regions at `tile` pixel precision.
+    """
+    old_rows, width = decode_bmp(old)
+    new_rows, new_width = decode_bmp(new)
+    height = new_rows.shape[0]
+    if old_rows.shape != new_rows.shape or width != new_width:
+        return new_width * height, [[0, 0, new_width, height]]
+
+    # padding bits are zero in both, so they never count as changes
+    changed = np.bitwise_xor(old_rows, new_rows)
+    changed_pixels = int(np.bitwise_count(changed).sum())
+    if not changed_pixels:
+        return 0, []
+
+    # which tile x tile squares have any change, tile being a multiple of 8
+    tile_bytes = tile // 8
+    rows, columns = -(-height // tile), -(-width // tile)
+    padded = np.zeros((rows * tile, columns * tile_bytes), dtype=np.uint8)
+    used = min(changed.shape[1], columns * tile_bytes)
+    padded[:height, :used] = changed[:, :used]
+    tiles = padded.reshape(rows, tile, columns, tile_bytes).any(axis=(1, 3))
+
+    regions = []
+    for top, left, bottom, right in _regions(tiles):
+        x, y = left * tile, top * tile
+        regions.append(
+            [
+                x,
+                y,
+                min((right + 1) * tile, width) - x,
+                min((bottom + 1) * tile, height) - y,
+            ]
+        )
+    return changed_pixels, regions
+
+
+def encode_png(pixels):
+    """Encode a 2D boolean array (True is white) as a 1-bit grayscale PNG.
+
+    Much smaller than the BMP, for showing a screen in a browser.
+    """
+    height, width = pixels.shape
+    # every scanline starts with its filter type, 0 for none
+    rows = np.packbits(pixels, axis=1)
+    scanlines = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows])
+
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data)
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            # 1-bit grayscale, no interlacing
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)),
+            chunk(b"IEND", b""),
+        ]
+    )
+
+
+def dither_png(png, dither=DITHER_FLOYD_STEINBERG):
+    """Convert a PNG screenshot into a 2D boolean array of 1-bit pixels."""
+    return DITHERERS[dither](to_grayscale(png))
+
+
+def png_to_bmp(png, dither=DITHER_FLOYD_STEINBERG):
+    """Convert a PNG screenshot into the 1-bit BMP a TRMNL displays."""
+    return encode_bmp(dither_png(png, dither))
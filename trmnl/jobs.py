@@ -0,0 +1,64 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Screen
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(screen):
+    """Queue `screen` to be rendered by a render worker."""
+    screen.status = Screen.Status.QUEUED
+    screen.error = ""
+    screen.started_at = None
+    screen.save()
+    return screen
+
+
+def claim_next_job():
+    """Claim the oldest queued screen, or return None if the queue is empty.
+
+    The claim is a conditional UPDATE so several workers, in this process or
+    on other nodes, can share the same queue without rendering a job twice.
+    """
+    while True:
+        with transaction.atomic():
+            screen = (
+                Screen.objects.filter(status=Screen.Status.QUEUED)
+                .order_by("created_at")
+                .first()
+            )
+            if not screen:
+                return None
+            now = timezone.now()
+            claimed = Screen.objects.filter(
+                pk=screen.pk, status=Screen.Status.QUEUED
+            ).update(status=Screen.Status.RENDERING, started_at=now)
+        if claimed:
+            screen.status = Screen.Status.RENDERING
+            screen.started_at = now
+            return screen
+        # another worker got there first, try the next one
+
+
+def run_job(screen):
+    """Render a claimed screen, recording a failure instead of raising."""
+    try:
+        screen.generate_screen()
+    except Exception as e:
+        logger.exception("Rendering screen %s failed", screen.pk)
+        screen.mark_failed(e)
+        return False
+    return True
+
+
+def requeue_stale_jobs():
+    """Put back jobs left in the rendering state by a worker that died."""
+    cutoff = timezone.now() - timedelta(seconds=settings.RENDER_JOB_TIMEOUT)
+    return Screen.objects.filter(
+        status=Screen.Status.RENDERING, started_at__lt=cutoff
+    ).update(status=Screen.Status.QUEUED, started_at=None)
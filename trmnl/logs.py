@@ -0,0 +1,129 @@
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from .background import PeriodicTask
+from .metrics import Collected
+from .models import DeviceLog
+
+logger = logging.getLogger(__name__)
+
+
+class LogBuffer:
+    """A bounded in-memory buffer of device logs, written with bulk_create.
+
+    Logs are flushed every `interval` seconds, or as soon as `batch_size` of
+    them are waiting. Once `max_size` logs are waiting, new ones are refused
+    so callers can push back on the device. A log's created_at is the time
+    it was received.
+
+    A batch that can't be written is kept for the next flush, unless it
+    broke a constraint, e.g. its device was deleted meanwhile. Then it is
+    written log by log and the logs that still fail are dropped, so one bad
+    log can't block the buffer for good.
+    """
+
+    def __init__(self, max_size, batch_size, interval):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.rejected = 0
+        self.dropped = 0
+        self._logs = []
+        self._lock = threading.Lock()
+        self.task = PeriodicTask(
+            self.flush, interval, name="log-buffer", run_at_exit=True
+        )
+
+    def __len__(self):
+        return len(self._logs)
+
+    def add(self, device_id, message):
+        """Buffer a log, returning False if the buffer is full."""
+        with self._lock:
+            if len(self._logs) >= self.max_size:
+                self.rejected += 1
+                return False
+            self._logs.append((device_id, message, timezone.now()))
+            batch_ready = len(self._logs) >= self.batch_size
+
+        if not self.task.interval:
+            self.flush()
+        else:
+            self.task.start()
+            if batch_ready:
+                self.task.trigger()
+        return True
+
+    async def aadd(self, device_id, message):
+        if self.task.interval:
+            # only touches memory, safe to call from the event loop
+            return self.add(device_id, message)
+        return await sync_to_async(self.add)(device_id, message)
+
+    def flush(self):
+        with self._lock:
+            logs, self._logs = self._logs, []
+        if not logs:
+            return
+        try:
+            DeviceLog.objects.bulk_create(
+                [self._device_log(log) for log in logs], batch_size=self.batch_size
+            )
+        except IntegrityError:
+            self._write_each(logs)
+        except Exception:
+            self._put_back(logs)
+            raise
+
+    @staticmethod
+    def _device_log(log):
+        device_id, message, created_at = log
+        return DeviceLog(device_id=device_id, message=message, created_at=created_at)
+
+    def _put_back(self, logs):
+        # in front of anything that arrived since, as far as the buffer
+        # allows, to try again on the next flush
+        with self._lock:
+            self._logs = (logs + self._logs)[: self.max_size]
+
+    def _write_each(self, logs):
+        dropped = 0
+        for i, log in enumerate(logs):
+            try:
+                self._device_log(log).save()
+            except IntegrityError:
+                dropped += 1
+                logger.warning("Dropped a log of device %s: %s", log[0], log[1])
+            except Exception:
+                self._put_back(logs[i:])
+                raise
+        self.dropped += dropped
+
+
+log_buffer = LogBuffer(
+    max_size=settings.LOG_BUFFER_SIZE,
+    batch_size=settings.LOG_BATCH_SIZE,
+    interval=settings.LOG_FLUSH_INTERVAL,
+)
+
+Collected(
+    "trmnl_log_buffer_pending",
+    "Device logs waiting to be written.",
+    lambda: len(log_buffer),
+)
+Collected(
+    "trmnl_log_buffer_dropped_total",
+    "Device logs dropped because they couldn't be written.",
+    lambda: log_buffer.dropped,
+    type="counter",
+)
+Collected(
+    "trmnl_log_buffer_rejected_total",
+    "Device logs refused because the buffer was full.",
+    lambda: log_buffer.rejected,
+    type="counter",
+)
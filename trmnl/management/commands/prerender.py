@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from trmnl.scheduler import run_prerender
+
+
+class Command(BaseCommand):
+    help = "Render the screens of devices about to poll."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lead",
+            type=int,
+            default=settings.PRERENDER_LEAD,
+            help="Seconds before a device's next poll to render its screen.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.PRERENDER_BATCH_SIZE,
+            help="Most screens to render in one run.",
+        )
+
+    def handle(self, *args, **options):
+        rendered = run_prerender(options["lead"], options["batch_size"])
+        self.stdout.write(f"Pre-rendered {rendered} screen(s)")
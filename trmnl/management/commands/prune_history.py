@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from trmnl.retention import (
+    VACUUM_MODES,
+    enable_incremental_vacuum,
+    prune_logs,
+    prune_screens,
+    vacuum,
+)
+
+
+class Command(BaseCommand):
+    help = "Delete old screens and device logs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-screens",
+            type=int,
+            default=settings.RETENTION_SCREENS,
+            help="Rendered screens to keep per device, 0 keeps all of them.",
+        )
+        parser.add_argument(
+            "--log-days",
+            type=int,
+            default=settings.RETENTION_LOG_DAYS,
+            help="Days of device logs to keep, 0 keeps all of them.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.RETENTION_BATCH_SIZE,
+            help="Rows to delete per statement.",
+        )
+        parser.add_argument(
+            "--vacuum",
+            choices=VACUUM_MODES,
+            default=settings.RETENTION_VACUUM,
+            help="How to reclaim the space freed in the SQLite database.",
+        )
+        parser.add_argument(
+            "--enable-incremental-vacuum",
+            action="store_true",
+            help="Switch the SQLite database to incremental vacuum first. "
+            "This rewrites the whole database once.",
+        )
+
+    def handle(self, *args, **options):
+        if options["enable_incremental_vacuum"]:
+            enable_incremental_vacuum()
+            self.stdout.write("Incremental vacuum enabled")
+
+        if options["keep_screens"]:
+            deleted = prune_screens(options["keep_screens"], options["batch_size"])
+            self.stdout.write(f"Deleted {deleted} screen(s)")
+        if options["log_days"]:
+            deleted = prune_logs(options["log_days"], options["batch_size"])
+            self.stdout.write(f"Deleted {deleted} log(s)")
+        if vacuum(options["vacuum"]):
+            self.stdout.write("Database vacuumed")
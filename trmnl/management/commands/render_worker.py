@@ -0,0 +1,78 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trmnl.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Render queued screens."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.RENDER_WORKER_CONCURRENCY,
+            help="Number of screens to render at the same time.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.RENDER_WORKER_POLL_INTERVAL,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for more jobs.",
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.poll_interval = options["poll_interval"]
+        self.once = options["once"]
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        threads = [
+            threading.Thread(target=self.work, name=f"render-worker-{i}")
+            for i in range(options["concurrency"])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Render worker started with {len(threads)} thread(s)")
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write("Finishing in-flight jobs...")
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self):
+        while not self.stop.is_set():
+            close_old_connections()
+            screen = claim_next_job()
+            if not screen:
+                if self.once:
+                    break
+                self.stop.wait(self.poll_interval)
+                requeue_stale_jobs()
+                continue
+
+            start_time = time.time()
+            if run_job(screen):
+                self.stdout.write(
+                    f"Rendered screen {screen.pk} in {time.time() - start_time:.2f}s"
+                )
+            else:
+                self.stderr.write(f"Screen {screen.pk} failed: {screen.error}")
+        close_old_connections()
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from trmnl.assets import find_assets, warm
+from trmnl.models import ScreenTemplate
+from trmnl.templating import base_html
+
+
+class Command(BaseCommand):
+    help = "Fetch the assets screens load into the asset cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "urls",
+            nargs="*",
+            help="More asset URLs to fetch, besides those of the base template "
+            "and the screen templates.",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Fetch assets again even if they are cached, e.g. to pick up "
+            "a new version of the TRMNL framework.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.ASSET_CACHE_DIR:
+            raise CommandError("The asset cache is disabled, set ASSET_CACHE_DIR")
+
+        urls = find_assets(base_html())
+        for body in ScreenTemplate.objects.values_list("body", flat=True):
+            urls += find_assets(body)
+        urls += options["urls"]
+
+        cached, failed = warm(urls, refresh=options["refresh"])
+        self.stdout.write(
+            f"Fetched {len(cached)} asset(s) into {settings.ASSET_CACHE_DIR}"
+        )
+        if failed:
+            raise CommandError(f"Couldn't fetch {len(failed)} asset(s)")
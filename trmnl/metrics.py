@@ -0,0 +1,202 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from inspect import iscoroutinefunction
+
+# Metrics live in memory and are per process, each process exposes its own.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (name suffix, labels, value) for every series."""
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", key, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # a count per bucket (the last for +Inf), then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), values):
+                cumulative += count
+                yield "_bucket", (*key, ("le", _format_value(bound))), cumulative
+            yield "_sum", key, values[-1]
+            yield "_count", key, cumulative
+
+
+class Collected(Metric):
+    """A metric read from elsewhere, e.g. a cache's own counters, at scrape
+    time. `collect` returns its value, or a {label values: value} dict.
+    """
+
+    def __init__(self, name, documentation, collect, type="gauge", labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            yield "", (), values
+            return
+        for label_values, value in values.items():
+            yield "", tuple(zip(self.labelnames, label_values)), value
+
+
+def expose():
+    """All metrics in the Prometheus text format."""
+    return "\n".join(metric.expose() for metric in registry) + "\n"
+
+
+render_stage_seconds = Histogram(
+    "trmnl_render_stage_seconds",
+    "Time spent in each stage of rendering a screen.",
+    ["stage"],
+)
+renders_total = Counter(
+    "trmnl_renders_total", "Screens rendered, by result.", ["result"]
+)
+render_load_timeouts_total = Counter(
+    "trmnl_render_load_timeouts_total",
+    "Screenshots taken before the page finished loading.",
+)
+request_seconds = Histogram(
+    "trmnl_request_seconds",
+    "Latency of the device and API endpoints.",
+    ["endpoint"],
+)
+requests_total = Counter(
+    "trmnl_requests_total",
+    "Requests to the device and API endpoints, by response status.",
+    ["endpoint", "status"],
+)
+
+
+def timed_view(endpoint):
+    """Record the latency and response status of a view."""
+
+    def decorator(view_func):
+        def record(start_time, status):
+            request_seconds.observe(time.perf_counter() - start_time, endpoint=endpoint)
+            requests_total.inc(endpoint=endpoint, status=status)
+
+        if iscoroutinefunction(view_func):
+
+            async def _view_wrapper(request, *args, **kwargs):
+                start_time = time.perf_counter()
+                status = 500
+                try:
+                    response = await view_func(request, *args, **kwargs)
+                    status = response.status_code
+                    return response
+                finally:
+                    record(start_time, status)
+
+        else:
+
+            def _view_wrapper(request, *args, **kwargs):
+                start_time = time.perf_counter()
+                status = 500
+                try:
+                    response = view_func(request, *args, **kwargs)
+                    status = response.status_code
+                    return response
+                finally:
+                    record(start_time, status)
+
+        return functools.wraps(view_func)(_view_wrapper)
+
+    return decorator
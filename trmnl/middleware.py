@@ -1,19 +1,32 @@
 from asyncio import iscoroutinefunction
 from functools import wraps
 
+from asgiref.sync import markcoroutinefunction
 from django.http import JsonResponse
 
-from .models import APIKey
+from .auth import aget_api_key
 
 
 class ApiKeyAuthMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         return self.get_response(request)
 
-    def process_view(self, request, view_func, view_args, view_kwargs):
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    # Django adapts an async process_view when serving synchronously, so the
+    # API key lookup never blocks the event loop under ASGI
+    async def process_view(self, request, view_func, view_args, view_kwargs):
         if not getattr(view_func, "require_api_key", False):
             return
 
@@ -26,7 +39,7 @@ class ApiKeyAuthMiddleware:
             api_key = api_key.split("Bearer ")[1]
 
         # Check if the API key is valid
-        api_key = APIKey.objects.filter(key=api_key).first()
+        api_key = await aget_api_key(api_key)
         if not api_key:
             return self.reject
 
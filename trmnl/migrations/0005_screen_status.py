@@ -0,0 +1,51 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:27
+
+from django.db import migrations, models
+
+
+def set_initial_status(apps, schema_editor):
+    Screen = apps.get_model("trmnl", "Screen")
+    # screens created before the queue existed were rendered inline, so any
+    # that were never generated failed to render
+    Screen.objects.filter(generated=True).update(status="done")
+    Screen.objects.filter(generated=False).update(status="failed")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0004_alter_device_last_seen_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="screen",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="screen",
+            name="rendered_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="screen",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="screen",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("rendering", "Rendering"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                ],
+                default="queued",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(set_initial_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+from trmnl.storage import get_blob_store
+
+BATCH_SIZE = 200
+
+
+def move_images_to_blob_store(apps, schema_editor):
+    Screen = apps.get_model("trmnl", "Screen")
+    store = get_blob_store()
+    screens = Screen.objects.filter(generated=True).only("id", "screen")
+    batch = []
+    for screen in screens.iterator(chunk_size=BATCH_SIZE):
+        if not screen.screen:
+            continue
+        screen.image_hash = store.put(bytes(screen.screen))
+        batch.append(screen)
+        if len(batch) >= BATCH_SIZE:
+            Screen.objects.bulk_update(batch, ["image_hash"])
+            batch = []
+    Screen.objects.bulk_update(batch, ["image_hash"])
+
+
+def move_images_to_database(apps, schema_editor):
+    Screen = apps.get_model("trmnl", "Screen")
+    store = get_blob_store()
+    screens = Screen.objects.exclude(image_hash="").only("id", "image_hash")
+    batch = []
+    for screen in screens.iterator(chunk_size=BATCH_SIZE):
+        screen.screen = store.get(screen.image_hash) or b""
+        batch.append(screen)
+        if len(batch) >= BATCH_SIZE:
+            Screen.objects.bulk_update(batch, ["screen"])
+            batch = []
+    Screen.objects.bulk_update(batch, ["screen"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0005_screen_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="screen",
+            name="image_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(move_images_to_blob_store, move_images_to_database),
+        # give the column a default in the migration state only, so unapplying
+        # the removal below can re-add it to a table that already has rows
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="screen",
+                    name="screen",
+                    field=models.BinaryField(default=b""),
+                ),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name="screen",
+            name="screen",
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0006_screen_image_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="devicelog",
+            index=models.Index(
+                fields=["device", "-created_at"], name="devicelog_device_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="devicelog",
+            index=models.Index(fields=["created_at"], name="devicelog_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="screen",
+            index=models.Index(
+                condition=models.Q(("generated", True)),
+                fields=["device", "-created_at"],
+                name="screen_device_latest_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="screen",
+            index=models.Index(
+                fields=["status", "created_at"], name="screen_queue_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0007_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="device",
+            name="plugin",
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="plugin_config",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="prerendered_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
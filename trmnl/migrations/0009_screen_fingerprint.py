@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0008_device_plugin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="screen",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0009_screen_fingerprint"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScreenTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.SlugField()),
+                (
+                    "body",
+                    models.TextField(
+                        default='{% extends "base.html" %}\n\n{% block content %}\n<div class="layout">\n    <span class="value">{{ value }}</span>\n</div>\n{% endblock %}\n\n{% block title %}{{ title }}{% endblock %}\n',
+                        help_text="A Django template, the API's variables are its context.",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "name"), name="screentemplate_user_name_unique"
+                    )
+                ],
+            },
+        ),
+    ]
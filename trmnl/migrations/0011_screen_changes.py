@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0010_screentemplate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="screen",
+            name="changed_pixels",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="screen",
+            name="changed_regions",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name="screen",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("rendering", "Rendering"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                    ("unchanged", "Unchanged"),
+                ],
+                default="queued",
+                max_length=10,
+            ),
+        ),
+    ]
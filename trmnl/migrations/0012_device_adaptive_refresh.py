@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0011_screen_changes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="device",
+            name="adaptive_refresh",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="max_refresh_rate",
+            field=models.IntegerField(default=3600),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="min_refresh_rate",
+            field=models.IntegerField(default=300),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="quiet_hours_end",
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="device",
+            name="quiet_hours_start",
+            field=models.TimeField(blank=True, null=True),
+        ),
+    ]
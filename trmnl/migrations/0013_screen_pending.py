@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0012_device_adaptive_refresh"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="screen",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("queued", "Queued"),
+                    ("rendering", "Rendering"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                    ("unchanged", "Unchanged"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:04
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0013_screen_pending"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="devicelog",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:08
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def set_next_poll_at(apps, schema_editor):
+    Device = apps.get_model("trmnl", "Device")
+    # a good enough guess until each device polls again and is told its rate
+    for device in Device.objects.filter(last_seen_at__isnull=False).iterator():
+        device.next_poll_at = device.last_seen_at + timedelta(
+            seconds=device.refresh_rate
+        )
+        device.save(update_fields=["next_poll_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0014_devicelog_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="device",
+            name="next_poll_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_next_poll_at, migrations.RunPython.noop),
+    ]
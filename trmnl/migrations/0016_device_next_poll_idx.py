@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trmnl", "0015_device_next_poll_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="device",
+            index=models.Index(fields=["next_poll_at"], name="device_next_poll_idx"),
+        ),
+    ]
@@ -1,16 +1,31 @@
 import base64
 import random
 import re
-import shutil
 import string
-import tempfile
 
-from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.template import TemplateSyntaxError
 from django.utils import timezone
-from playwright.sync_api import sync_playwright
-from wand.image import Image
+
+from .imaging import diff_bmp
+from .metrics import render_stage_seconds
+from .plugins import PLUGINS, get_plugin
+from .rendering import arender_html, render_html
+from .storage import get_blob_store
+from .templating import compile_template, render_screen_template
+
+DEFAULT_TEMPLATE_BODY = """{% extends "base.html" %}
+
+{% block content %}
+<div class="layout">
+    <span class="value">{{ value }}</span>
+</div>
+{% endblock %}
+
+{% block title %}{{ title }}{% endblock %}
+"""
 
 
 class Device(models.Model):
@@ -24,8 +39,28 @@ class Device(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)
     updated_at = models.DateTimeField(auto_now=True, null=False, blank=False)
     last_seen_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # last_seen_at plus the refresh rate the device was given then
+    next_poll_at = models.DateTimeField(null=True, blank=True)
     refreshes = models.IntegerField(default=0)
     refresh_rate = models.IntegerField(default=900)
+    # derive the refresh rate from how often the screen changes, between the
+    # bounds, instead of using refresh_rate
+    adaptive_refresh = models.BooleanField(default=False)
+    min_refresh_rate = models.IntegerField(default=300)
+    max_refresh_rate = models.IntegerField(default=3600)
+    # no polls in between, in the server's time zone
+    quiet_hours_start = models.TimeField(null=True, blank=True)
+    quiet_hours_end = models.TimeField(null=True, blank=True)
+    # content rendered ahead of each poll by the pre-render scheduler
+    plugin = models.CharField(max_length=50, blank=True)
+    plugin_config = models.JSONField(default=dict, blank=True)
+    prerendered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the pre-render scheduler looks for devices about to poll
+            models.Index(fields=["next_poll_at"], name="device_next_poll_idx"),
+        ]
 
     def __str__(self):
         return f"{self.device_name} ({self.friendly_id})"
@@ -35,6 +70,12 @@ class Device(models.Model):
         self.mac_address = self.mac_address.upper()
         if not re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", self.mac_address):
             raise ValidationError({"mac_address": "Invalid MAC address format."})
+        if self.plugin and self.plugin not in PLUGINS:
+            raise ValidationError({"plugin": "Unknown plugin."})
+        if self.min_refresh_rate > self.max_refresh_rate:
+            raise ValidationError(
+                {"max_refresh_rate": "Must not be below the minimum refresh rate."}
+            )
 
     def save(self, *args, **kwargs):
         # Generate a random API key on first create
@@ -53,76 +94,177 @@ class Device(models.Model):
 
         super().save(*args, **kwargs)
 
-    def get_screen(self, update_last_seen=False):
-        screen = self.screen_set.order_by("-created_at").first()
-        if update_last_seen:
-            self.last_seen_at = timezone.now()
-            self.refreshes += 1
-            self.save()
-
-        if screen:
-            return screen
-
-        return None
+    def get_plugin(self):
+        if not self.plugin:
+            return None
+        return get_plugin(self.plugin, self.plugin_config)
 
 
 class DeviceLog(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
     message = models.JSONField()
-    created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)
+    # set when the log is received, it may be written a little later
+    created_at = models.DateTimeField(default=timezone.now, null=False, blank=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["device", "-created_at"], name="devicelog_device_idx"),
+            # retention deletes by age across all devices
+            models.Index(fields=["created_at"], name="devicelog_created_idx"),
+        ]
 
 
 class Screen(models.Model):
+    class Status(models.TextChoices):
+        # not rendered yet and not queued either, whoever created it renders it
+        PENDING = "pending", "Pending"
+        QUEUED = "queued", "Queued"
+        RENDERING = "rendering", "Rendering"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+        # rendered identical to the device's current screen, which stays
+        UNCHANGED = "unchanged", "Unchanged"
+
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
     html = models.TextField()
-    screen = models.BinaryField()
+    # SHA-256 of the rendered BMP, which lives in the blob store
+    image_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # fingerprint of the plugin inputs the HTML was generated from, if any
+    fingerprint = models.CharField(max_length=64, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)
     generated = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    error = models.TextField(blank=True, default="")
+    started_at = models.DateTimeField(null=True, blank=True)
+    rendered_at = models.DateTimeField(null=True, blank=True)
+    # what changed since the device's previous screen: the number of pixels,
+    # and [x, y, width, height] boxes around them
+    changed_pixels = models.IntegerField(null=True, blank=True)
+    changed_regions = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        indexes = [
+            # a device's latest rendered screen, and retention's cutoff. Partial,
+            # as a boolean filter is compiled to a bare column check that a
+            # plain index on "generated" can't serve
+            models.Index(
+                fields=["device", "-created_at"],
+                condition=models.Q(generated=True),
+                name="screen_device_latest_idx",
+            ),
+            # render workers take the oldest queued job
+            models.Index(fields=["status", "created_at"], name="screen_queue_idx"),
+        ]
+
+    def _set_rendered(self, image_hash):
+        self.image_hash = image_hash
+        self.generated = True
+        self.status = Screen.Status.DONE
+        self.error = ""
+        self.rendered_at = timezone.now()
+
+    def _set_unchanged(self, image_hash):
+        self.image_hash = image_hash
+        self.generated = False
+        self.status = Screen.Status.UNCHANGED
+        self.error = ""
+        self.rendered_at = timezone.now()
+        self.changed_pixels = 0
+        self.changed_regions = []
+
+    def previous_screen(self):
+        """The screen the device shows, not counting this one."""
+        return (
+            Screen.objects.filter(device_id=self.device_id, generated=True)
+            .exclude(pk=self.pk)
+            .defer("html")
+            .order_by("-created_at")
+            .first()
+        )
+
+    def apply_render(self, bmp, previous=None):
+        """Store a rendered BMP, comparing it with the `previous` screen.
+
+        A render identical to the previous one doesn't replace it, the screen
+        is marked unchanged instead so the device isn't sent the same image.
+        """
+        store = get_blob_store()
+        image_hash = store.digest(bmp)
+        if previous is not None and previous.image_hash == image_hash:
+            self._set_unchanged(image_hash)
+            return
+        if previous is not None and previous.image_hash:
+            old_bmp = store.get(previous.image_hash)
+            if old_bmp is not None:
+                self.changed_pixels, self.changed_regions = diff_bmp(old_bmp, bmp)
+        self._set_rendered(store.put(bmp))
+
+    def _apply_render(self, bmp):
+        with render_stage_seconds.time(stage="store"):
+            previous = self.previous_screen()
+            self.apply_render(bmp, previous)
+        return previous
+
+    def render(self):
+        """Render the screen's HTML without saving it."""
+        self._apply_render(render_html(self.html))
 
     def generate_screen(self):
-        # get random file name
-        folder = tempfile.mkdtemp()
-
-        with sync_playwright() as p:
-            if settings.PW_SERVER:
-                browser = p.firefox.connect(ws_endpoint=settings.PW_SERVER)
-            else:
-                browser = p.firefox.launch(
-                    headless=True,
-                    args=["--window-size=800,480", "--disable-web-security"],
-                )
-            page = browser.new_page()
-            page.set_viewport_size({"width": 800, "height": 480})
-
-            page.set_content(self.html)
-            page.evaluate(
-                'document.getElementsByTagName("html")[0].style.overflow = "hidden";'
-                'document.getElementsByTagName("body")[0].style.overflow = "hidden";'
-            )
-            page.screenshot(path=f"/{folder}/screen.png")
-            browser.close()
-
-        with Image(filename=f"/{folder}/screen.png") as img:
-            img.posterize(2, dither="floyd_steinberg")
-            amap = Image(width=img.width, height=img.height, pseudo="pattern:gray50")
-            amap.composite(img, 0, 0)
-            img = amap
-            img.quantize(2, colorspace_type="gray")
-            img.depth = 1
-            img.strip()
-            img.save(filename=f"bmp3:/{folder}/screen.bmp")
-
-        with open(f"/{folder}/screen.bmp", "rb") as f:
-            self.screen = f.read()
-            self.generated = True
+        self.render()
+        with render_stage_seconds.time(stage="db_write"):
             self.save()
 
-        # clean up
-        shutil.rmtree(folder, ignore_errors=True)
+    def _shown_screen(self, previous):
+        # an unchanged render isn't worth a row, the device keeps its screen
+        if self.status == Screen.Status.UNCHANGED:
+            previous.device = self.device
+            return previous
+        return self
+
+    def generate_new_screen(self):
+        """Render a screen that isn't saved yet, and save it unless it looks
+        just like the device's current screen.
+
+        Returns the screen the device shows: this one, or the current one.
+        """
+        shown = self._shown_screen(self._apply_render(render_html(self.html)))
+        if shown is self:
+            with render_stage_seconds.time(stage="db_write"):
+                self.save()
+        return shown
+
+    async def agenerate_new_screen(self):
+        bmp = await arender_html(self.html)
+        shown = self._shown_screen(await sync_to_async(self._apply_render)(bmp))
+        if shown is self:
+            with render_stage_seconds.time(stage="db_write"):
+                await self.asave()
+        return shown
+
+    def mark_failed(self, error):
+        self.status = Screen.Status.FAILED
+        self.error = str(error)
+        self.save(update_fields=["status", "error"] if self.pk else None)
+
+    async def amark_failed(self, error):
+        self.status = Screen.Status.FAILED
+        self.error = str(error)
+        await self.asave(update_fields=["status", "error"] if self.pk else None)
+
+    @property
+    def image(self):
+        if not self.image_hash:
+            return None
+        return get_blob_store().get(self.image_hash)
 
     @property
     def image_as_base64(self):
-        return f"data:image/bmp;base64,{base64.b64encode(self.screen).decode()}"
+        image = self.image
+        if image is None:
+            return None
+        return f"data:image/bmp;base64,{base64.b64encode(image).decode()}"
 
     @property
     def image_as_url_for_device(self):
@@ -134,6 +276,38 @@ class Screen(models.Model):
         return f"{self.device.friendly_id}-{self.id}.bmp"
 
 
+class ScreenTemplate(models.Model):
+    name = models.SlugField(max_length=50)
+    user = models.ForeignKey(
+        "auth.User", on_delete=models.CASCADE, null=False, blank=False
+    )
+    body = models.TextField(
+        default=DEFAULT_TEMPLATE_BODY,
+        help_text="A Django template, the API's variables are its context.",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)
+    updated_at = models.DateTimeField(auto_now=True, null=False, blank=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "name"], name="screentemplate_user_name_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        try:
+            compile_template(self.body)
+        except TemplateSyntaxError as e:
+            raise ValidationError({"body": str(e)})
+
+    def render(self, variables):
+        return render_screen_template(self, variables)
+
+
 class APIKey(models.Model):
     name = models.CharField(max_length=50, null=False, blank=False)
     key = models.CharField(max_length=32, unique=True, null=False, blank=False)
@@ -1,14 +1,98 @@
+import hashlib
+import json
+import urllib.request
+
+from django.template import Context, Template
+
+# plugins a device can be set to show, by the name stored on the device
+PLUGINS = {}
+
+
+def register(name):
+    """Class decorator adding a plugin to the registry under `name`."""
+
+    def decorator(plugin_class):
+        if name in PLUGINS:
+            raise ValueError(f"Plugin {name} is already registered")
+        plugin_class.name = name
+        PLUGINS[name] = plugin_class
+        return plugin_class
+
+    return decorator
+
+
+def get_plugin(name, config):
+    """Instantiate the plugin registered as `name`."""
+    try:
+        plugin_class = PLUGINS[name]
+    except KeyError:
+        raise ValueError(f"Unknown plugin: {name}") from None
+    return plugin_class(config)
+
+
+def plugin_choices():
+    return [
+        (name, plugin_class.verbose_name or name)
+        for name, plugin_class in sorted(PLUGINS.items())
+    ]
+
+
 class BasePlugin:
+    """Turns some data into the HTML of a screen.
+
+    `get_data` gathers everything the screen depends on and `generate_html`
+    renders it. The data is fingerprinted, so a screen is only rendered again
+    once something it shows has changed.
+    """
+
+    name = None
+    verbose_name = None
+
     def __init__(self, config):
         self.config = config
 
-    def generate_html(self):
+    def get_data(self):
+        return None
+
+    def fingerprint(self, data):
+        """Hash of everything the HTML is generated from."""
+        inputs = {"plugin": self.name, "config": self.config, "data": data}
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def generate_html(self, data=None):
         raise NotImplementedError
 
     def __str__(self):
         return f"<Plugin {self.__class__.__name__}>"
 
 
+@register("static_html")
 class StaticHTMLPlugin(BasePlugin):
-    def generate_html(self):
+    verbose_name = "Static HTML"
+
+    def generate_html(self, data=None):
         return self.config["html"]
+
+
+@register("json_feed")
+class JSONFeedPlugin(BasePlugin):
+    """Fetches JSON from `url` and renders it with a Django `template`.
+
+    The template gets the response as `data`.
+    """
+
+    verbose_name = "JSON feed"
+
+    def get_data(self):
+        request = urllib.request.Request(
+            self.config["url"],
+            headers={"Accept": "application/json", **self.config.get("headers", {})},
+        )
+        with urllib.request.urlopen(
+            request, timeout=self.config.get("timeout", 10)
+        ) as response:
+            return json.load(response)
+
+    def generate_html(self, data=None):
+        return Template(self.config["template"]).render(Context({"data": data}))
@@ -0,0 +1,136 @@
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .background import PeriodicTask
+from .models import Device
+
+# cached in place of a screen for devices that don't have one yet
+NO_SCREEN = "none"
+
+
+def _device_key(api_key, mac_address):
+    return f"trmnl:device:{api_key}:{mac_address}"
+
+
+def _api_key_key(api_key):
+    return f"trmnl:device:{api_key}"
+
+
+def _screen_key(device_id):
+    return f"trmnl:device:{device_id}:screen"
+
+
+async def aget_device(api_key, mac_address):
+    """Resolve the device polling with these credentials, or None."""
+    key = _device_key(api_key, mac_address)
+    device = await cache.aget(key)
+    if device is None:
+        device = await Device.objects.filter(
+            api_key=api_key, mac_address=mac_address
+        ).afirst()
+        if device:
+            await cache.aset(key, device, settings.DISPLAY_CACHE_TIMEOUT)
+    return device
+
+
+async def aget_device_by_api_key(api_key):
+    key = _api_key_key(api_key)
+    device = await cache.aget(key)
+    if device is None:
+        device = await Device.objects.filter(api_key=api_key).afirst()
+        if device:
+            await cache.aset(key, device, settings.DISPLAY_CACHE_TIMEOUT)
+    return device
+
+
+async def aget_latest_screen(device):
+    """Return the screen `device` should show, or None."""
+    key = _screen_key(device.pk)
+    screen = await cache.aget(key)
+    if screen is None:
+        screen = await (
+            device.screen_set.filter(generated=True)
+            .defer("html")
+            .order_by("-created_at")
+            .afirst()
+        )
+        if screen:
+            # keep the device around so building its URL needs no query
+            screen.device = device
+        await cache.aset(key, screen or NO_SCREEN, settings.DISPLAY_CACHE_TIMEOUT)
+    return None if screen == NO_SCREEN else screen
+
+
+def invalidate_device(device):
+    cache.delete_many(
+        [
+            _device_key(device.api_key, device.mac_address),
+            _api_key_key(device.api_key),
+            _screen_key(device.pk),
+        ]
+    )
+
+
+def invalidate_latest_screen(device_id):
+    cache.delete(_screen_key(device_id))
+
+
+class PollRecorder:
+    """Buffers device polls and writes them out in batches.
+
+    Instead of saving the whole Device on every poll, polls are counted in
+    memory and flushed periodically as one UPDATE per device.
+    """
+
+    def __init__(self, interval):
+        self._polls = {}
+        self._lock = threading.Lock()
+        self.task = PeriodicTask(
+            self.flush, interval, name="poll-recorder", run_at_exit=True
+        )
+
+    def record(self, device_id, refresh_rate):
+        """Record a poll, `refresh_rate` being what the device was told."""
+        now = timezone.now()
+        next_poll_at = now + timedelta(seconds=refresh_rate)
+        with self._lock:
+            count, _, _ = self._polls.get(device_id, (0, None, None))
+            self._polls[device_id] = (count + 1, now, next_poll_at)
+        if self.task.interval:
+            self.task.start()
+        else:
+            self.flush()
+
+    async def arecord(self, device_id, refresh_rate):
+        if self.task.interval:
+            # only touches memory, safe to call from the event loop
+            self.record(device_id, refresh_rate)
+        else:
+            await sync_to_async(self.record)(device_id, refresh_rate)
+
+    def flush(self):
+        with self._lock:
+            polls, self._polls = self._polls, {}
+        if not polls:
+            return
+        with transaction.atomic():
+            for device_id, (count, last_seen_at, next_poll_at) in polls.items():
+                Device.objects.filter(pk=device_id).update(
+                    last_seen_at=last_seen_at,
+                    next_poll_at=next_poll_at,
+                    refreshes=F("refreshes") + count,
+                )
+
+
+poll_recorder = PollRecorder(settings.POLL_FLUSH_INTERVAL)
+
+
+async def arecord_poll(device, refresh_rate):
+    await poll_recorder.arecord(device.pk, refresh_rate)
@@ -0,0 +1,97 @@
+import statistics
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Screen
+
+
+def _refresh_key(device_id):
+    return f"trmnl:device:{device_id}:refresh_rate"
+
+
+def invalidate_refresh_rate(device_id):
+    cache.delete(_refresh_key(device_id))
+
+
+def adaptive_refresh_rate(device, change_times, now):
+    """Pick a refresh rate from when the device's screen last changed.
+
+    Polling at half the typical (median) time between changes catches most
+    changes within half an interval, while static content polls rarely. The
+    time since the latest change counts as an interval still going on, so a
+    device whose content stopped changing backs off to its maximum.
+    `change_times` are the creation times of its latest screens.
+    """
+    if not change_times:
+        # nothing has ever changed
+        return device.max_refresh_rate
+    change_times = sorted(change_times)
+    intervals = [
+        (later - earlier).total_seconds()
+        for earlier, later in zip(change_times, change_times[1:])
+    ]
+    since_last = (now - change_times[-1]).total_seconds()
+    rate = max(statistics.median(intervals) if intervals else 0, since_last) / 2
+    return int(min(max(rate, device.min_refresh_rate), device.max_refresh_rate))
+
+
+def quiet_hours_remaining(device, now):
+    """Seconds left of the device's quiet hours at `now`, 0 outside them."""
+    start, end = device.quiet_hours_start, device.quiet_hours_end
+    if start is None or end is None or start == end:
+        return 0
+    now = timezone.localtime(now)
+    current = now.time()
+    if start < end:
+        quiet = start <= current < end
+    else:
+        # the quiet hours wrap around midnight
+        quiet = current >= start or current < end
+    if not quiet:
+        return 0
+    end_at = datetime.combine(now.date(), end, now.tzinfo)
+    if end_at <= now:
+        end_at += timedelta(days=1)
+    return int((end_at - now).total_seconds())
+
+
+def effective_refresh_rate(device, rate, now):
+    """`rate`, or the rest of the quiet hours if the device is in them."""
+    return max(rate, quiet_hours_remaining(device, now))
+
+
+def _recent_changes(device):
+    return (
+        Screen.objects.filter(device_id=device.pk, generated=True)
+        .order_by("-created_at")
+        .values_list("created_at", flat=True)[: settings.ADAPTIVE_REFRESH_HISTORY]
+    )
+
+
+def get_refresh_rate(device, now=None):
+    """The refresh rate to give `device` when it polls at `now`."""
+    now = now or timezone.now()
+    if not device.adaptive_refresh:
+        return effective_refresh_rate(device, device.refresh_rate, now)
+    key = _refresh_key(device.pk)
+    rate = cache.get(key)
+    if rate is None:
+        rate = adaptive_refresh_rate(device, list(_recent_changes(device)), now)
+        cache.set(key, rate, settings.DISPLAY_CACHE_TIMEOUT)
+    return effective_refresh_rate(device, rate, now)
+
+
+async def aget_refresh_rate(device, now=None):
+    now = now or timezone.now()
+    if not device.adaptive_refresh:
+        return effective_refresh_rate(device, device.refresh_rate, now)
+    key = _refresh_key(device.pk)
+    rate = await cache.aget(key)
+    if rate is None:
+        change_times = [t async for t in _recent_changes(device)]
+        rate = adaptive_refresh_rate(device, change_times, now)
+        await cache.aset(key, rate, settings.DISPLAY_CACHE_TIMEOUT)
+    return effective_refresh_rate(device, rate, now)
@@ -0,0 +1,730 @@
+import asyncio
+import atexit
+import hashlib
+import logging
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from playwright.async_api import async_playwright
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from playwright.sync_api import sync_playwright
+
+from .assets import aroute_asset, route_asset, routing_enabled
+from .browsers import NoBrowserServer, get_browser_servers
+from .cache import LRUCache
+from .imaging import dither_png, encode_bmp
+from .metrics import (
+    Collected,
+    render_load_timeouts_total,
+    render_stage_seconds,
+    renders_total,
+)
+
+logger = logging.getLogger(__name__)
+
+VIEWPORT = {"width": 800, "height": 480}
+BROWSER_ARGS = ["--window-size=800,480", "--disable-web-security"]
+HIDE_OVERFLOW = (
+    'document.getElementsByTagName("html")[0].style.overflow = "hidden";'
+    'document.getElementsByTagName("body")[0].style.overflow = "hidden";'
+)
+# resolves once the page's web fonts are in, or after the given milliseconds
+WAIT_FOR_FONTS = (
+    "ms => Promise.race([document.fonts.ready,"
+    " new Promise(resolve => setTimeout(resolve, ms))])"
+)
+
+
+def _load_timeout():
+    # Playwright takes milliseconds
+    return settings.RENDER_LOAD_TIMEOUT * 1000
+
+
+def _load_timed_out(timeout):
+    render_load_timeouts_total.inc()
+    logger.info("Page still loading after %ss, rendering it anyway", timeout / 1000)
+
+
+def load_html(page, html):
+    """Put `html` in `page`, giving what it loads RENDER_LOAD_TIMEOUT seconds.
+
+    A slow third party only delays the screenshot, which then shows whatever
+    has loaded by then.
+    """
+    timeout = _load_timeout()
+    try:
+        page.set_content(html, wait_until="domcontentloaded", timeout=timeout)
+        page.wait_for_load_state("load", timeout=timeout)
+    except PlaywrightTimeoutError:
+        _load_timed_out(timeout)
+    page.evaluate(WAIT_FOR_FONTS, timeout)
+    page.evaluate(HIDE_OVERFLOW)
+
+
+async def aload_html(page, html):
+    """The async counterpart of load_html."""
+    timeout = _load_timeout()
+    try:
+        await page.set_content(html, wait_until="domcontentloaded", timeout=timeout)
+        await page.wait_for_load_state("load", timeout=timeout)
+    except PlaywrightTimeoutError:
+        _load_timed_out(timeout)
+    await page.evaluate(WAIT_FOR_FONTS, timeout)
+    await page.evaluate(HIDE_OVERFLOW)
+
+
+def _connect_failed(servers, server, tried):
+    logger.warning("Couldn't connect to browser server %s", server)
+    servers.release(server, failed=True)
+    tried.add(server)
+
+
+def _release_server(server, failed):
+    if server is not None:
+        get_browser_servers().release(server, failed=failed)
+
+
+def launch_browser(playwright):
+    """Launch a browser, on one of the PW_SERVERS if there are any.
+
+    Returns the browser and the server it runs on, None for a local one.
+    Release the server with close_browser. A server that can't be connected
+    to is marked down and the next one tried.
+    """
+    servers = get_browser_servers()
+    if not servers:
+        return playwright.firefox.launch(headless=True, args=BROWSER_ARGS), None
+    tried = set()
+    while True:
+        server = servers.acquire(exclude=tried)
+        try:
+            return playwright.firefox.connect(ws_endpoint=server.url), server
+        except PlaywrightError:
+            _connect_failed(servers, server, tried)
+
+
+async def alaunch_browser(playwright):
+    """The async counterpart of launch_browser."""
+    servers = get_browser_servers()
+    if not servers:
+        browser = await playwright.firefox.launch(headless=True, args=BROWSER_ARGS)
+        return browser, None
+    tried = set()
+    while True:
+        server = servers.acquire(exclude=tried)
+        try:
+            return await playwright.firefox.connect(ws_endpoint=server.url), server
+        except PlaywrightError:
+            _connect_failed(servers, server, tried)
+
+
+def close_browser(browser, server):
+    # a browser that lost its connection lost it to the server going down
+    failed = not browser.is_connected()
+    try:
+        browser.close()
+    except PlaywrightError:
+        # already gone, nothing left to clean up
+        pass
+    finally:
+        _release_server(server, failed)
+
+
+async def aclose_browser(browser, server):
+    failed = not browser.is_connected()
+    try:
+        await browser.close()
+    except PlaywrightError:
+        pass
+    finally:
+        _release_server(server, failed)
+
+
+@contextmanager
+def render_slot(server):
+    """Hold one of `server`'s render slots while rendering, if the browser
+    runs on one.
+    """
+    if server is None:
+        yield
+        return
+    servers = get_browser_servers()
+    servers.start_render(server, timeout=settings.RENDER_TIMEOUT)
+    try:
+        yield
+    finally:
+        servers.end_render(server)
+
+
+@asynccontextmanager
+async def arender_slot(server):
+    """The async counterpart of render_slot."""
+    if server is None:
+        yield
+        return
+    servers = get_browser_servers()
+    deadline = time.monotonic() + settings.RENDER_TIMEOUT
+    # polled, waiting on the servers' condition would block the event loop
+    while not servers.try_start_render(server):
+        if time.monotonic() >= deadline:
+            raise NoBrowserServer(f"Browser server {server} is busy")
+        await asyncio.sleep(0.05)
+    try:
+        yield
+    finally:
+        servers.end_render(server)
+
+
+class _BrowserWorkerBase:
+    """The browser, page and recycling policy BrowserWorker and
+    AsyncBrowserWorker share.
+    """
+
+    def __init__(self, playwright, max_renders):
+        self.playwright = playwright
+        self.max_renders = max_renders
+        self._reset()
+
+    def _reset(self, browser=None, server=None):
+        self.browser = browser
+        self.server = server
+        self.page = None
+        self.renders = 0
+
+    def is_healthy(self):
+        return (
+            self.browser is not None
+            and self.browser.is_connected()
+            and self.page is not None
+            and not self.page.is_closed()
+        )
+
+    def needs_launch(self):
+        # recycle the browser every so often so leaks don't pile up
+        return self.renders >= self.max_renders or not self.is_healthy()
+
+    def crashed(self):
+        """Whether a failed render lost its browser, and is worth retrying
+        once on a fresh one.
+        """
+        if self.is_healthy():
+            return False
+        logger.warning("Browser crashed while rendering, relaunching")
+        return True
+
+
+class BrowserWorker(_BrowserWorkerBase):
+    """A single warm browser and page, owned by one pool thread.
+
+    Playwright's sync API is bound to the thread that started it, so a worker
+    must only ever be used from the thread that created it.
+    """
+
+    def launch(self):
+        with render_stage_seconds.time(stage="launch"):
+            self._reset(*launch_browser(self.playwright))
+            self.page = self.browser.new_page(viewport=VIEWPORT)
+            if routing_enabled():
+                self.page.route("**/*", route_asset)
+
+    def close(self):
+        if self.browser is not None:
+            close_browser(self.browser, self.server)
+        self._reset()
+
+    def screenshot(self, html):
+        if self.needs_launch():
+            self.close()
+            self.launch()
+        try:
+            data = self._screenshot(html)
+        except PlaywrightError:
+            if not self.crashed():
+                raise
+            self.close()
+            self.launch()
+            data = self._screenshot(html)
+        self.renders += 1
+        return data
+
+    def _screenshot(self, html):
+        with render_slot(self.server):
+            with render_stage_seconds.time(stage="set_content"):
+                load_html(self.page, html)
+            with render_stage_seconds.time(stage="screenshot"):
+                return self.page.screenshot()
+
+
+class AsyncBrowserWorker(_BrowserWorkerBase):
+    """The async counterpart of BrowserWorker."""
+
+    async def launch(self):
+        with render_stage_seconds.time(stage="launch"):
+            self._reset(*await alaunch_browser(self.playwright))
+            self.page = await self.browser.new_page(viewport=VIEWPORT)
+            if routing_enabled():
+                await self.page.route("**/*", aroute_asset)
+
+    async def close(self):
+        if self.browser is not None:
+            await aclose_browser(self.browser, self.server)
+        self._reset()
+
+    async def screenshot(self, html):
+        if self.needs_launch():
+            await self.close()
+            await self.launch()
+        try:
+            data = await self._screenshot(html)
+        except PlaywrightError:
+            if not self.crashed():
+                raise
+            await self.close()
+            await self.launch()
+            data = await self._screenshot(html)
+        self.renders += 1
+        return data
+
+    async def _screenshot(self, html):
+        async with arender_slot(self.server):
+            with render_stage_seconds.time(stage="set_content"):
+                await aload_html(self.page, html)
+            with render_stage_seconds.time(stage="screenshot"):
+                return await self.page.screenshot()
+
+
+class BrowserPool:
+    """A process-wide pool of warm browsers.
+
+    Each worker thread owns one browser and takes render jobs off a shared
+    queue, so callers from any thread can render without paying browser
+    startup on every screen.
+    """
+
+    def __init__(self, size=1, max_renders=100, timeout=None):
+        self.size = size
+        self.max_renders = max_renders
+        self.timeout = timeout
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.size):
+                thread = threading.Thread(
+                    target=self._run, name=f"browser-pool-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self, timeout=5):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def screenshot(self, html):
+        """Render `html` and return the PNG screenshot bytes."""
+        self.start()
+        future = Future()
+        self._jobs.put((html, future, time.perf_counter()))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # don't leave the job queued for a caller that has given up
+            future.cancel()
+            raise
+
+    def _run(self):
+        with sync_playwright() as p:
+            worker = BrowserWorker(p, self.max_renders)
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                html, future, queued_at = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                render_stage_seconds.observe(
+                    time.perf_counter() - queued_at, stage="acquire"
+                )
+                try:
+                    future.set_result(worker.screenshot(html))
+                except Exception as e:
+                    future.set_exception(e)
+            worker.close()
+
+
+_browser_pool = None
+_browser_pool_lock = threading.Lock()
+
+
+def get_browser_pool():
+    global _browser_pool
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            _browser_pool = BrowserPool(
+                size=settings.RENDER_POOL_SIZE,
+                max_renders=settings.RENDER_POOL_MAX_RENDERS,
+                timeout=settings.RENDER_TIMEOUT,
+            )
+            atexit.register(_browser_pool.shutdown)
+        return _browser_pool
+
+
+class AsyncBrowserPool:
+    """Warm browsers for async code, such as the async views.
+
+    Playwright's async objects belong to the event loop that created them,
+    so there is one pool per loop, see get_async_browser_pool.
+    """
+
+    def __init__(self, size=1, max_renders=100, timeout=None):
+        self.size = size
+        self.max_renders = max_renders
+        self.timeout = timeout
+        self._playwright = None
+        self._workers = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def playwright(self):
+        return self._playwright
+
+    async def start(self):
+        async with self._lock:
+            if self._workers is not None:
+                return
+            self._playwright = await async_playwright().start()
+            self._workers = asyncio.Queue()
+            for _ in range(self.size):
+                # browsers are launched on first use
+                self._workers.put_nowait(
+                    AsyncBrowserWorker(self._playwright, self.max_renders)
+                )
+
+    async def shutdown(self):
+        async with self._lock:
+            if self._workers is None:
+                return
+            for _ in range(self.size):
+                worker = await self._workers.get()
+                await worker.close()
+            await self._playwright.stop()
+            self._workers = None
+            self._playwright = None
+
+    async def screenshot(self, html):
+        """Render `html` and return the PNG screenshot bytes."""
+        await self.start()
+        with render_stage_seconds.time(stage="acquire"):
+            worker = await self._workers.get()
+        try:
+            return await asyncio.wait_for(worker.screenshot(html), self.timeout)
+        except TimeoutError:
+            # the page may be stuck mid render, start over with a new browser
+            await worker.close()
+            raise
+        finally:
+            self._workers.put_nowait(worker)
+
+
+_async_browser_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_browser_pool():
+    loop = asyncio.get_running_loop()
+    pool = _async_browser_pools.get(loop)
+    if pool is None:
+        pool = _async_browser_pools[loop] = AsyncBrowserPool(
+            size=settings.RENDER_POOL_SIZE,
+            max_renders=settings.RENDER_POOL_MAX_RENDERS,
+            timeout=settings.RENDER_TIMEOUT,
+        )
+    return pool
+
+
+class PreviewBusy(Exception):
+    pass
+
+
+class PreviewSession:
+    """A user's browser context and page for the live preview.
+
+    All of a user's preview connections share it, one render at a time.
+    """
+
+    def __init__(self, context, page, server=None, timeout=None):
+        self.context = context
+        self.page = page
+        self.server = server
+        self.timeout = timeout
+        self.connections = 0
+        self.last_used = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def closed(self):
+        return self.page.is_closed()
+
+    async def screenshot(self, html):
+        async with self._lock:
+            self.last_used = time.monotonic()
+            return await asyncio.wait_for(self._screenshot(html), self.timeout)
+
+    async def _screenshot(self, html):
+        async with arender_slot(self.server):
+            await aload_html(self.page, html)
+            return await self.page.screenshot()
+
+    async def close(self):
+        try:
+            await self.context.close()
+        except PlaywrightError:
+            # went down with the browser
+            pass
+
+
+class PreviewContextPool:
+    """Live preview sessions, each in its own context of one shared browser.
+
+    A user's session outlives their connections by `idle_timeout` seconds, so
+    reloading the editor or reconnecting reuses it. At most `max_contexts`
+    sessions exist at once, the least recently used idle one makes room for
+    a new one; when none is idle, acquire raises PreviewBusy.
+    """
+
+    def __init__(self, max_contexts, idle_timeout, timeout=None):
+        self.max_contexts = max_contexts
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._browser = None
+        self._server = None
+        self._sessions = {}
+        self._lock = asyncio.Lock()
+        self._reaper = None
+
+    async def _close_browser(self):
+        await aclose_browser(self._browser, self._server)
+        self._browser = None
+        self._server = None
+
+    async def _get_browser(self):
+        if self._browser is not None and not self._browser.is_connected():
+            # any contexts went down with the old browser
+            self._sessions.clear()
+            await self._close_browser()
+        if self._browser is None:
+            pool = get_async_browser_pool()
+            await pool.start()
+            self._browser, self._server = await alaunch_browser(pool.playwright)
+        return self._browser
+
+    async def acquire(self, user_id):
+        async with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or session.closed:
+                browser = await self._get_browser()
+                self._sessions.pop(user_id, None)
+                if len(self._sessions) >= self.max_contexts:
+                    await self._evict()
+                context = await browser.new_context(viewport=VIEWPORT)
+                if routing_enabled():
+                    await context.route("**/*", aroute_asset)
+                session = self._sessions[user_id] = PreviewSession(
+                    context, await context.new_page(), self._server, self.timeout
+                )
+            session.connections += 1
+            if self._reaper is None:
+                self._reaper = asyncio.create_task(self._reap_forever())
+            return session
+
+    def release(self, session):
+        session.connections -= 1
+        session.last_used = time.monotonic()
+
+    async def _evict(self):
+        idle = [
+            (user_id, session)
+            for user_id, session in self._sessions.items()
+            if not session.connections
+        ]
+        if not idle:
+            raise PreviewBusy("Too many previews are open, try again later")
+        user_id, session = min(idle, key=lambda item: item[1].last_used)
+        del self._sessions[user_id]
+        await session.close()
+
+    async def reap(self):
+        """Close the sessions nobody has used for `idle_timeout` seconds."""
+        cutoff = time.monotonic() - self.idle_timeout
+        async with self._lock:
+            for user_id, session in list(self._sessions.items()):
+                if not session.connections and session.last_used < cutoff:
+                    del self._sessions[user_id]
+                    await session.close()
+            if not self._sessions and self._browser is not None:
+                # nothing left to preview, give the memory back
+                await self._close_browser()
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60))
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("Reaping preview sessions failed")
+
+
+_preview_pools = weakref.WeakKeyDictionary()
+
+
+def get_preview_pool():
+    loop = asyncio.get_running_loop()
+    pool = _preview_pools.get(loop)
+    if pool is None:
+        pool = _preview_pools[loop] = PreviewContextPool(
+            max_contexts=settings.PREVIEW_MAX_CONTEXTS,
+            idle_timeout=settings.PREVIEW_IDLE_TIMEOUT,
+            timeout=settings.RENDER_TIMEOUT,
+        )
+    return pool
+
+
+# finished renders keyed by a hash of their HTML and render parameters, so the
+# same dashboard pushed to a whole fleet is only rendered once
+render_cache = LRUCache(settings.RENDER_CACHE_SIZE)
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+Collected(
+    "trmnl_render_cache_hits_total",
+    "Renders served from the render cache.",
+    lambda: render_cache.hits,
+    type="counter",
+)
+Collected(
+    "trmnl_render_cache_misses_total",
+    "Renders not found in the render cache.",
+    lambda: render_cache.misses,
+    type="counter",
+)
+Collected(
+    "trmnl_render_cache_bytes",
+    "Size of the renders in the render cache.",
+    lambda: render_cache.size,
+)
+
+
+def _png_to_bmp(png, dither):
+    with render_stage_seconds.time(stage="dither"):
+        pixels = dither_png(png, dither)
+    with render_stage_seconds.time(stage="encode"):
+        return encode_bmp(pixels)
+
+
+def render_cache_key(html, dither):
+    params = f"{VIEWPORT['width']}x{VIEWPORT['height']}:{dither}\n"
+    return hashlib.sha256(params.encode() + html.encode()).hexdigest()
+
+
+def is_render_cached(html, dither=None):
+    return render_cache_key(html, dither or settings.RENDER_DITHER) in render_cache
+
+
+def render_html(html, dither=None):
+    """Render `html` to a 1-bit BMP, reusing any earlier render of the same HTML."""
+    dither = dither or settings.RENDER_DITHER
+    key = render_cache_key(html, dither)
+    bmp = render_cache.get(key)
+    if bmp is not None:
+        return bmp
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        # the same HTML is being rendered right now, wait for that instead
+        return future.result(timeout=settings.RENDER_TIMEOUT)
+
+    try:
+        bmp = _png_to_bmp(get_browser_pool().screenshot(html), dither)
+    except Exception as e:
+        renders_total.inc(result="error")
+        future.set_exception(e)
+        raise
+    else:
+        renders_total.inc(result="ok")
+        render_cache.set(key, bmp)
+        future.set_result(bmp)
+        return bmp
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+
+async def _arender_owned(key, html, dither, future):
+    try:
+        png = await get_async_browser_pool().screenshot(html)
+        # dithering is CPU bound, keep it off the event loop
+        bmp = await asyncio.to_thread(_png_to_bmp, png, dither)
+    except Exception as e:
+        renders_total.inc(result="error")
+        future.set_exception(e)
+        raise
+    else:
+        renders_total.inc(result="ok")
+        render_cache.set(key, bmp)
+        future.set_result(bmp)
+        return bmp
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        # cancelled itself, e.g. as the loop shuts down: waiters start over
+        future.cancel()
+
+
+async def arender_html(html, dither=None):
+    """The async counterpart of render_html."""
+    dither = dither or settings.RENDER_DITHER
+    key = render_cache_key(html, dither)
+    bmp = render_cache.get(key)
+    if bmp is not None:
+        return bmp
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if owner:
+        # shielded, so the render goes on for the others waiting on it if
+        # the request that started it is cancelled
+        task = asyncio.ensure_future(_arender_owned(key, html, dither, future))
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(task)
+
+    # the same HTML is being rendered right now, wait for that instead,
+    # shielded so giving up on it doesn't cancel the render for everyone
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), settings.RENDER_TIMEOUT
+        )
+    except asyncio.CancelledError:
+        if not future.cancelled():
+            raise
+    return await arender_html(html, dither)
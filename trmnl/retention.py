@@ -0,0 +1,147 @@
+import logging
+import operator
+from datetime import timedelta
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .background import PeriodicTask
+from .models import Device, DeviceLog, Screen
+from .storage import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+VACUUM_NONE = "none"
+VACUUM_INCREMENTAL = "incremental"
+VACUUM_FULL = "full"
+VACUUM_MODES = (VACUUM_NONE, VACUUM_INCREMENTAL, VACUUM_FULL)
+
+
+def _delete_screens(ids):
+    hashes = set(
+        Screen.objects.filter(pk__in=ids)
+        .exclude(image_hash="")
+        .values_list("image_hash", flat=True)
+    )
+    deleted, _ = Screen.objects.filter(pk__in=ids).delete()
+
+    # images are shared between screens, only drop the ones nothing uses now.
+    # A render may have just stored one again without saving its screen yet,
+    # so recently stored images are kept until a later sweep
+    still_used = set(
+        Screen.objects.filter(image_hash__in=hashes).values_list(
+            "image_hash", flat=True
+        )
+    )
+    store = get_blob_store()
+    for image_hash in hashes - still_used:
+        store.delete(image_hash, older_than=settings.RETENTION_BLOB_GRACE)
+    return deleted
+
+
+def _cutoff(screens, keep):
+    """Creation time of the newest `keep`th of `screens`, or None."""
+    newest = screens.order_by("-created_at").values_list("created_at", flat=True)
+    return next(iter(newest[keep - 1 : keep]), None)
+
+
+def prune_screens(keep, batch_size):
+    """Delete all but the newest `keep` rendered screens of every device.
+
+    Unchanged and failed screens are kept to the newest `keep` of their own,
+    as a device whose content stopped changing would otherwise gather them
+    forever. Screens still waiting for a render worker are left alone.
+    """
+    finished = [Screen.Status.UNCHANGED, Screen.Status.FAILED]
+    deleted = 0
+    for device_id in Device.objects.values_list("pk", flat=True).iterator():
+        screens = Screen.objects.filter(device_id=device_id)
+        old = []
+        cutoff = _cutoff(screens.filter(generated=True), keep)
+        if cutoff is not None:
+            old.append(Q(created_at__lt=cutoff))
+        cutoff = _cutoff(screens.filter(status__in=finished), keep)
+        if cutoff is not None:
+            old.append(Q(status__in=finished, created_at__lt=cutoff))
+        if not old:
+            continue
+
+        old_screens = screens.filter(reduce(operator.or_, old)).exclude(
+            status__in=[
+                Screen.Status.PENDING,
+                Screen.Status.QUEUED,
+                Screen.Status.RENDERING,
+            ]
+        )
+        while ids := list(old_screens.values_list("pk", flat=True)[:batch_size]):
+            deleted += _delete_screens(ids)
+    return deleted
+
+
+def prune_logs(days, batch_size):
+    """Delete device logs older than `days` days."""
+    cutoff = timezone.now() - timedelta(days=days)
+    old_logs = DeviceLog.objects.filter(created_at__lt=cutoff)
+    deleted = 0
+    while ids := list(old_logs.values_list("pk", flat=True)[:batch_size]):
+        count, _ = DeviceLog.objects.filter(pk__in=ids).delete()
+        deleted += count
+    return deleted
+
+
+def enable_incremental_vacuum():
+    """Switch SQLite to incremental auto vacuum, which needs a full VACUUM."""
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+
+
+def vacuum(mode):
+    """Give space freed by deleted rows back to the filesystem (SQLite only)."""
+    if mode == VACUUM_NONE or connection.vendor != "sqlite":
+        return False
+
+    with connection.cursor() as cursor:
+        if mode == VACUUM_FULL:
+            cursor.execute("VACUUM")
+            return True
+
+        cursor.execute("PRAGMA auto_vacuum")
+        # 2 is INCREMENTAL, anything else ignores incremental_vacuum
+        if cursor.fetchone()[0] != 2:
+            logger.warning(
+                "Incremental vacuum is not enabled on this database, run "
+                "prune_history --enable-incremental-vacuum once to enable it"
+            )
+            return False
+        cursor.execute("PRAGMA incremental_vacuum")
+        return True
+
+
+def run_retention():
+    """Apply the configured retention policies."""
+    result = {"screens": 0, "logs": 0, "vacuumed": False}
+    if settings.RETENTION_SCREENS:
+        result["screens"] = prune_screens(
+            settings.RETENTION_SCREENS, settings.RETENTION_BATCH_SIZE
+        )
+    if settings.RETENTION_LOG_DAYS:
+        result["logs"] = prune_logs(
+            settings.RETENTION_LOG_DAYS, settings.RETENTION_BATCH_SIZE
+        )
+    if result["screens"] or result["logs"]:
+        result["vacuumed"] = vacuum(settings.RETENTION_VACUUM)
+    logger.info(
+        "Retention removed %s screen(s) and %s log(s)",
+        result["screens"],
+        result["logs"],
+    )
+    return result
+
+
+retention_sweeper = PeriodicTask(
+    run_retention, settings.RETENTION_INTERVAL, name="retention-sweeper"
+)
@@ -0,0 +1,125 @@
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .background import PeriodicTask
+from .jobs import enqueue
+from .models import Device, Screen
+
+logger = logging.getLogger(__name__)
+
+
+def prerender_at(device, lead):
+    """When to render the screen for the next poll of `device`.
+
+    Every device gets a fixed offset into the lead window, so a fleet on the
+    same refresh rate doesn't all render in the same tick.
+    """
+    if device.next_poll_at is None:
+        return None
+    offset = zlib.crc32(device.friendly_id.encode()) % (lead // 2 + 1)
+    return device.next_poll_at - timedelta(seconds=lead - offset)
+
+
+def prerender_candidates(now, lead):
+    """Devices due to poll within `lead` seconds that haven't been rendered
+    for that poll yet, the most urgent first.
+
+    A device only needs a render once per poll: after one, it waits until
+    the device has polled again. Devices that went offline stop there too.
+    """
+    return (
+        Device.objects.exclude(plugin="")
+        .filter(next_poll_at__lte=now + timedelta(seconds=lead))
+        .filter(
+            Q(prerendered_at__isnull=True) | Q(prerendered_at__lt=F("last_seen_at"))
+        )
+        .order_by("next_poll_at")
+    )
+
+
+def due_devices(now, lead, limit):
+    """The first `limit` candidates whose pre-render time has come, the rest
+    wait for the next tick.
+    """
+    due = []
+    for device in prerender_candidates(now, lead).iterator():
+        if prerender_at(device, lead) <= now:
+            due.append(device)
+            if len(due) == limit:
+                break
+    return due
+
+
+def latest_fingerprint(device):
+    """Fingerprint of the newest screen of `device` that hasn't failed."""
+    return (
+        device.screen_set.exclude(status=Screen.Status.FAILED)
+        .order_by("-created_at")
+        .values_list("fingerprint", flat=True)
+        .first()
+    )
+
+
+def prerender(device, now):
+    """Render the configured content of `device` for its next poll.
+
+    Returns the new screen, or None if another process claimed the device or
+    neither the plugin's data nor the rendered image changed since its last
+    screen.
+    """
+    # claim it first, so several app processes can run the scheduler
+    claimed = Device.objects.filter(
+        pk=device.pk, prerendered_at=device.prerendered_at
+    ).update(prerendered_at=now)
+    if not claimed:
+        return None
+
+    screen = Screen(device=device)
+    try:
+        plugin = device.get_plugin()
+        data = plugin.get_data()
+        screen.fingerprint = plugin.fingerprint(data)
+        if screen.fingerprint == latest_fingerprint(device):
+            # the current screen already shows this, don't render it again
+            return None
+        screen.html = plugin.generate_html(data)
+    except Exception as e:
+        screen.save()
+        screen.mark_failed(e)
+        raise
+
+    if settings.RENDER_QUEUE:
+        return enqueue(screen)
+    try:
+        shown = screen.generate_new_screen()
+    except Exception as e:
+        screen.mark_failed(e)
+        raise
+    # None if it looks just like what the device already has
+    return screen if shown is screen else None
+
+
+def run_prerender(lead=None, limit=None):
+    """Pre-render the screens of every device about to poll."""
+    lead = settings.PRERENDER_LEAD if lead is None else lead
+    limit = settings.PRERENDER_BATCH_SIZE if limit is None else limit
+    now = timezone.now()
+    rendered = 0
+    for device in due_devices(now, lead, limit):
+        try:
+            rendered += prerender(device, now) is not None
+        except Exception:
+            logger.exception("Pre-rendering for device %s failed", device.pk)
+    if rendered:
+        logger.info("Pre-rendered %s screen(s)", rendered)
+    return rendered
+
+
+prerender_scheduler = PeriodicTask(
+    run_prerender, settings.PRERENDER_INTERVAL, name="prerender-scheduler"
+)
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import invalidate_api_key
+from .models import APIKey, Device, Screen
+from .polling import invalidate_device, invalidate_latest_screen
+from .refresh import invalidate_refresh_rate
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def device_changed(sender, instance, **kwargs):
+    invalidate_device(instance)
+    invalidate_refresh_rate(instance.pk)
+
+
+@receiver(post_save, sender=Screen)
+@receiver(post_delete, sender=Screen)
+def screen_changed(sender, instance, **kwargs):
+    invalidate_latest_screen(instance.device_id)
+    invalidate_refresh_rate(instance.device_id)
+
+
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def api_key_changed(sender, instance, **kwargs):
+    invalidate_api_key(instance.key)
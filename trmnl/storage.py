@@ -0,0 +1,189 @@
+import functools
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+def write_atomic(path, data):
+    """Write `data` to `path`, which readers see either whole or not at all."""
+    # write to a temporary file first, then move it into place at once
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class BlobStore:
+    """Content-addressed storage for rendered images.
+
+    Blobs are stored under the SHA-256 of their content, so storing the same
+    image twice only keeps one copy.
+    """
+
+    extension = ".bmp"
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def key(self, digest):
+        # shard by the first bytes so no directory ends up with every blob
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{self.extension}"
+
+    def put(self, data):
+        """Store `data` and return its digest.
+
+        Storing a blob that already exists counts as storing it anew, so
+        `delete` with `older_than` leaves it alone.
+        """
+        raise NotImplementedError
+
+    def get(self, digest):
+        """Return the blob stored under `digest`, or None if there is none."""
+        raise NotImplementedError
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest, older_than=None):
+        """Delete a blob, unless it was stored less than `older_than` seconds
+        ago: whatever stored it may not have saved its screen yet.
+        """
+        raise NotImplementedError
+
+
+class FileSystemBlobStore(BlobStore):
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, digest):
+        return self.root / self.key(digest)
+
+    def put(self, data):
+        digest = self.digest(data)
+        path = self.path(digest)
+        try:
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, data)
+        return digest
+
+    def get(self, digest):
+        try:
+            return self.path(digest).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, digest):
+        return self.path(digest).exists()
+
+    def delete(self, digest, older_than=None):
+        path = self.path(digest)
+        if older_than:
+            try:
+                if time.time() - path.stat().st_mtime < older_than:
+                    return
+            except FileNotFoundError:
+                return
+        path.unlink(missing_ok=True)
+
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3 compatible bucket.
+
+    `client` can be anything implementing the boto3 S3 client methods used
+    here; by default a boto3 client is created from `client_options`.
+    """
+
+    def __init__(self, bucket, prefix="", client=None, **client_options):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImproperlyConfigured("S3BlobStore requires boto3 to be installed")
+            client = boto3.client("s3", **client_options)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, digest):
+        return f"{self.prefix}{super().key(digest)}"
+
+    @staticmethod
+    def _is_missing(error):
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, data):
+        digest = self.digest(data)
+        if self.exists(digest):
+            # copied onto itself, so its last modified time is now
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=self.key(digest),
+                CopySource={"Bucket": self.bucket, "Key": self.key(digest)},
+                MetadataDirective="REPLACE",
+                ContentType="image/bmp",
+            )
+        else:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.key(digest),
+                Body=data,
+                ContentType="image/bmp",
+            )
+        return digest
+
+    def get(self, digest):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(digest))
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return response["Body"].read()
+
+    def exists(self, digest):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+        return True
+
+    def delete(self, digest, older_than=None):
+        if older_than:
+            try:
+                response = self.client.head_object(
+                    Bucket=self.bucket, Key=self.key(digest)
+                )
+            except Exception as e:
+                if self._is_missing(e):
+                    return
+                raise
+            age = datetime.now(timezone.utc) - response["LastModified"]
+            if age.total_seconds() < older_than:
+                return
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(digest))
+
+
+@functools.cache
+def get_blob_store():
+    backend = import_string(settings.BLOB_STORE["BACKEND"])
+    return backend(**settings.BLOB_STORE.get("OPTIONS", {}))
@@ -0,0 +1,35 @@
+import functools
+
+from django.conf import settings
+from django.template import engines
+from django.template.loader import get_template
+
+from .cache import LRUCache
+
+# compiled screen templates, keyed by their pk and last edit so a change is
+# picked up straight away
+template_cache = LRUCache(settings.TEMPLATE_CACHE_SIZE, sizeof=lambda template: 1)
+
+
+def compile_template(body):
+    return engines["django"].from_string(body)
+
+
+def get_compiled_template(screen_template):
+    key = (screen_template.pk, screen_template.updated_at)
+    template = template_cache.get(key)
+    if template is None:
+        template = compile_template(screen_template.body)
+        template_cache.set(key, template)
+    return template
+
+
+def render_screen_template(screen_template, variables):
+    """Render the HTML of a screen from a ScreenTemplate and its variables."""
+    return get_compiled_template(screen_template).render(variables)
+
+
+@functools.cache
+def base_html():
+    """base.html with its default content, as shown by the live preview."""
+    return get_template("base.html").render()
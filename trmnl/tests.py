@@ -1,3 +1,306 @@
-from django.test import TestCase
+import struct
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .cache import LRUCache, TTLCache
+from .imaging import decode_bmp, diff_bmp, encode_bmp, floyd_steinberg
+from .logs import LogBuffer
+from .models import Device, DeviceLog, Screen
+from .refresh import adaptive_refresh_rate, quiet_hours_remaining
+from .retention import prune_screens
+
+
+def create_device(mac_address="AA:BB:CC:DD:EE:FF", **kwargs):
+    user = User.objects.create_user(f"user-{mac_address}")
+    return Device.objects.create(
+        mac_address=mac_address, device_name="Test", user=user, **kwargs
+    )
+
+
+class FloydSteinbergTests(TestCase):
+    def test_single_row(self):
+        # 200 -> white (error -55), 100 - 55 * 7/16 = 75.9 -> black
+        # (error 75.9), 100 + 75.9 * 7/16 = 133.2 -> white
+        gray = np.array([[200, 100, 100]], dtype=np.float32)
+        self.assertEqual(floyd_steinberg(gray).tolist(), [[True, False, True]])
+
+    def test_error_spreads_to_the_next_row(self):
+        # (0, 0) 100 -> black, error 100: (0, 1) 143.75, (1, 0) 131.25,
+        #   (1, 1) 106.25
+        # (0, 1) 143.75 -> white, error -111.25: (1, 0) 110.39,
+        #   (1, 1) 71.48
+        # (1, 0) 110.39 -> black, error 110.39: (1, 1) 119.78 -> black
+        gray = np.full((2, 2), 100, dtype=np.float32)
+        self.assertEqual(
+            floyd_steinberg(gray).tolist(), [[False, True], [False, False]]
+        )
+
+    def test_matches_scalar_reference(self):
+        gray = np.random.default_rng(0).integers(0, 256, (7, 11)).astype(np.float32)
+        expected = np.zeros(gray.shape, dtype=bool)
+        buf = gray.astype(np.float64)
+        height, width = gray.shape
+        for y in range(height):
+            for x in range(width):
+                expected[y, x] = white = buf[y, x] >= 128
+                error = buf[y, x] - 255 * white
+                for dy, dx, weight in ((0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)):
+                    if 0 <= y + dy < height and 0 <= x + dx < width:
+                        buf[y + dy, x + dx] += error * weight / 16
+        self.assertEqual(floyd_steinberg(gray).tolist(), expected.tolist())
+
+
+class BMPTests(TestCase):
+    def test_header_and_size(self):
+        bmp = encode_bmp(np.zeros((3, 10), dtype=bool))
+        # 62 byte headers and palette, rows of 2 bytes padded to 4
+        self.assertEqual(len(bmp), 62 + 3 * 4)
+        magic, size, _, _, offset = struct.unpack_from("<2sIHHI", bmp)
+        self.assertEqual((magic, size, offset), (b"BM", len(bmp), 62))
+        width, height, planes, bits = struct.unpack_from("<iiHH", bmp, 18)
+        self.assertEqual((width, height, planes, bits), (10, 3, 1, 1))
+
+    def test_round_trip(self):
+        pixels = np.random.default_rng(0).random((5, 13)) >= 0.5
+        rows, width = decode_bmp(encode_bmp(pixels))
+        self.assertEqual(width, 13)
+        unpacked = np.unpackbits(rows, axis=1)[:, :width].astype(bool)
+        self.assertEqual(unpacked.tolist(), pixels.tolist())
+
+
+class DiffBMPTests(TestCase):
+    def diff(self, *changed, shape=(32, 32)):
+        old = np.zeros(shape, dtype=bool)
+        new = old.copy()
+        for y, x in changed:
+            new[y, x] = True
+        return diff_bmp(encode_bmp(old), encode_bmp(new))
+
+    def test_unchanged(self):
+        self.assertEqual(self.diff(), (0, []))
+
+    def test_separate_regions(self):
+        self.assertEqual(
+            self.diff((0, 0), (20, 20)), (2, [[0, 0, 16, 16], [16, 16, 16, 16]])
+        )
+
+    def test_adjacent_tiles_merge(self):
+        self.assertEqual(self.diff((0, 0), (0, 17)), (2, [[0, 0, 32, 16]]))
+
+    def test_region_clipped_to_image(self):
+        self.assertEqual(self.diff((19, 19), shape=(20, 20)), (1, [[16, 16, 4, 4]]))
+
+    def test_size_change(self):
+        old = encode_bmp(np.zeros((16, 16), dtype=bool))
+        new = encode_bmp(np.zeros((16, 32), dtype=bool))
+        self.assertEqual(diff_bmp(old, new), (16 * 32, [[0, 0, 32, 16]]))
+
+
+class LogBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.device = create_device()
+
+    def test_full_buffer_refuses_logs(self):
+        buffer = LogBuffer(max_size=2, batch_size=10, interval=0)
+        buffer.task.interval = 3600
+        with mock.patch.object(buffer.task, "start"):
+            self.assertTrue(buffer.add(self.device.pk, "a"))
+            self.assertTrue(buffer.add(self.device.pk, "b"))
+            self.assertFalse(buffer.add(self.device.pk, "c"))
+        self.assertEqual((len(buffer), buffer.rejected), (2, 1))
+
+    def test_full_buffer_returns_503(self):
+        buffer = LogBuffer(max_size=0, batch_size=10, interval=3600)
+        with mock.patch("trmnl.views.log_buffer", buffer):
+            response = self.client.post(
+                "/api/log",
+                data={"message": "hi"},
+                content_type="application/json",
+                headers={"Access-Token": self.device.api_key},
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(buffer.rejected, 1)
+
+    def test_flush(self):
+        buffer = LogBuffer(max_size=10, batch_size=10, interval=3600)
+        with mock.patch.object(buffer.task, "start"):
+            buffer.add(self.device.pk, {"message": "a"})
+            buffer.add(self.device.pk, {"message": "b"})
+        self.assertEqual(DeviceLog.objects.count(), 0)
+        buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            list(DeviceLog.objects.order_by("pk").values_list("message", flat=True)),
+            [{"message": "a"}, {"message": "b"}],
+        )
+
+    def test_flush_drops_logs_of_deleted_devices(self):
+        other = create_device("11:22:33:44:55:66")
+        buffer = LogBuffer(max_size=10, batch_size=10, interval=3600)
+        with mock.patch.object(buffer.task, "start"):
+            buffer.add(self.device.pk, "kept")
+            buffer.add(other.pk, "dropped")
+        other.delete()
+        buffer.flush()
+        self.assertEqual(
+            list(DeviceLog.objects.values_list("message", flat=True)), ["kept"]
+        )
+        self.assertEqual((len(buffer), buffer.dropped), (0, 1))
+
+
+class PruneScreensTests(TestCase):
+    def setUp(self):
+        self.device = create_device()
+        self.start = timezone.now() - timedelta(days=1)
+        self.count = 0
+
+    def add_screens(self, n, **kwargs):
+        screens = Screen.objects.bulk_create(
+            Screen(device=self.device, html="", **kwargs) for _ in range(n)
+        )
+        for screen in screens:
+            # distinct, increasing creation times
+            self.count += 1
+            screen.created_at = self.start + timedelta(seconds=self.count)
+        Screen.objects.bulk_update(screens, ["created_at"])
+        return screens
+
+    def test_keeps_newest_generated(self):
+        self.add_screens(5, generated=True, status=Screen.Status.DONE)
+        newest = self.add_screens(3, generated=True, status=Screen.Status.DONE)
+        self.assertEqual(prune_screens(keep=3, batch_size=2), 5)
+        self.assertEqual(
+            set(Screen.objects.values_list("pk", flat=True)),
+            {screen.pk for screen in newest},
+        )
+
+    def test_leaves_waiting_screens(self):
+        waiting = self.add_screens(2, status=Screen.Status.QUEUED)
+        self.add_screens(3, generated=True, status=Screen.Status.DONE)
+        self.assertEqual(prune_screens(keep=1, batch_size=10), 2)
+        self.assertEqual(
+            Screen.objects.filter(pk__in=[s.pk for s in waiting]).count(), 2
+        )
+
+    def test_prunes_unchanged_and_failed(self):
+        generated = self.add_screens(3, generated=True, status=Screen.Status.DONE)
+        self.add_screens(20, status=Screen.Status.UNCHANGED)
+        self.add_screens(10, status=Screen.Status.FAILED)
+        newest = self.add_screens(5, status=Screen.Status.UNCHANGED)
+        self.assertEqual(prune_screens(keep=5, batch_size=7), 30)
+        self.assertEqual(
+            set(Screen.objects.values_list("pk", flat=True)),
+            {screen.pk for screen in generated + newest},
+        )
+
+
+class QuietHoursTests(TestCase):
+    def remaining(self, hour, minute=0, start=time(22), end=time(6)):
+        device = Device(quiet_hours_start=start, quiet_hours_end=end)
+        now = timezone.make_aware(datetime(2026, 1, 1, hour, minute))
+        return quiet_hours_remaining(device, now)
+
+    def test_before_midnight(self):
+        self.assertEqual(self.remaining(23), 7 * 3600)
+
+    def test_after_midnight(self):
+        self.assertEqual(self.remaining(5, 30), 30 * 60)
+
+    def test_outside(self):
+        self.assertEqual(self.remaining(12), 0)
+        self.assertEqual(self.remaining(6), 0)
+
+    def test_same_day(self):
+        self.assertEqual(self.remaining(13, start=time(12), end=time(14)), 3600)
+        self.assertEqual(self.remaining(14, start=time(12), end=time(14)), 0)
+
+    def test_not_set(self):
+        self.assertEqual(self.remaining(23, start=None), 0)
+
+
+class AdaptiveRefreshRateTests(TestCase):
+    def setUp(self):
+        self.device = Device(min_refresh_rate=300, max_refresh_rate=3600)
+        self.now = timezone.now()
+
+    def rate(self, *minutes_ago):
+        change_times = [self.now - timedelta(minutes=m) for m in minutes_ago]
+        return adaptive_refresh_rate(self.device, change_times, self.now)
+
+    def test_no_history(self):
+        self.assertEqual(self.rate(), 3600)
+
+    def test_half_the_median_interval(self):
+        # changes every 20 minutes, the latest just now
+        self.assertEqual(self.rate(0, 20, 40, 60), 600)
+
+    def test_backs_off_when_changes_stop(self):
+        # changed every 20 minutes, but not for the last 50
+        self.assertEqual(self.rate(50, 70, 90), 1500)
+
+    def test_clamped(self):
+        self.assertEqual(self.rate(0, 1, 2), 300)
+        self.assertEqual(self.rate(0, 600), 3600)
+
+
+class LRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=10)
+        cache.set("a", b"aaaa")
+        cache.set("b", b"bbbb")
+        cache.get("a")
+        cache.set("c", b"cccc")
+        self.assertNotIn("b", cache)
+        self.assertEqual((cache.get("a"), cache.get("c")), (b"aaaa", b"cccc"))
+        self.assertEqual(cache.size, 8)
+
+    def test_replacing_updates_size(self):
+        cache = LRUCache(max_size=10)
+        cache.set("a", b"aaaa")
+        cache.set("a", b"aa")
+        self.assertEqual(cache.size, 2)
+
+    def test_too_large_is_not_stored(self):
+        cache = LRUCache(max_size=4)
+        cache.set("a", b"aaaa")
+        cache.set("b", b"bbbbb")
+        self.assertEqual((cache.get("a"), cache.get("b")), (b"aaaa", None))
+
+    def test_counts_hits_and_misses(self):
+        cache = LRUCache(max_size=10)
+        cache.set("a", b"a")
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TTLCacheTests(TestCase):
+    @mock.patch("trmnl.cache.time.monotonic")
+    def test_expiry(self, monotonic):
+        cache = TTLCache(max_entries=10, timeout=60)
+        monotonic.return_value = 100
+        cache.set("a", "value")
+        monotonic.return_value = 159
+        self.assertEqual(cache.get("a"), "value")
+        monotonic.return_value = 160
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 0))
+
+    def test_evicts_beyond_max_entries(self):
+        cache = TTLCache(max_entries=2, timeout=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("c", 3)
+        self.assertNotIn("a", cache)
+        self.assertEqual((cache.get("b"), cache.get("c")), (2, 3))
+
+    def test_caches_falsy_values(self):
+        cache = TTLCache(max_entries=2, timeout=60)
+        cache.set("a", None)
+        self.assertIn("a", cache)
@@ -8,8 +8,11 @@ urlpatterns = [
     path("api/display/", views.display, name="display"),
     path("api/log", views.log, name="log"),
     path("api/v1/generate_screen", views.generate_screen, name="generate_screen"),
+    path("api/v1/generate_screens", views.generate_screens, name="generate_screens"),
+    path("api/v1/screens/<int:screen_id>", views.screen_status, name="screen_status"),
     path(
         "api/v1/media/<str:filename>", views.device_image_view, name="device_image_view"
     ),
     path("preview", views.preview, name="preview"),
+    path("metrics", views.metrics, name="metrics"),
 ]
@@ -1,20 +1,41 @@
+import asyncio
 import base64
 import json
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 
+from .batch import aqueue_screens, arender_screens
+from .jobs import enqueue
+from .logs import log_buffer
+from .metrics import expose, timed_view
 from .middleware import require_api_key
-from .models import Device, Screen
+from .models import Device, Screen, ScreenTemplate
+from .polling import (
+    aget_device,
+    aget_device_by_api_key,
+    aget_latest_screen,
+    arecord_poll,
+)
+from .refresh import aget_refresh_rate
+from .rendering import is_render_cached
+from .storage import get_blob_store
+from .templating import base_html
 
 
 def index(request):
     return redirect("admin:index")
 
 
-def setup(request):
+async def setup(request):
     # get mac from headers
     mac = request.headers.get("ID", None)
     if not mac:
@@ -29,9 +50,9 @@ def setup(request):
             status=200,
         )
     # get device from database
-    device = Device.objects.filter(mac_address=mac).first()
+    device = await Device.objects.filter(mac_address=mac).afirst()
     if device:
-        if device.user:
+        if device.user_id:
             # already set up, act as if we don't exist
             return JsonResponse(
                 {
@@ -56,7 +77,7 @@ def setup(request):
                 status=200,
             )
 
-    device = Device.objects.create(mac_address=mac, device_name="A TRMNL Device")
+    device = await Device.objects.acreate(mac_address=mac, device_name="A TRMNL Device")
     return JsonResponse(
         {
             "status": 200,
@@ -70,7 +91,8 @@ def setup(request):
     )
 
 
-def display(request):
+@timed_view("display")
+async def display(request):
     # get mac from headers
     api_key = request.headers.get("Access-Token", None)
     mac = request.headers.get("ID", None)
@@ -83,8 +105,8 @@ def display(request):
             },
             status=200,
         )
-    # get device from database
-    device = Device.objects.filter(api_key=api_key, mac_address=mac).first()
+    # get device from cache or database
+    device = await aget_device(api_key, mac)
     if not device:
         return JsonResponse(
             {
@@ -95,7 +117,7 @@ def display(request):
             status=200,
         )
 
-    if not device.user:
+    if not device.user_id:
         return JsonResponse(
             {
                 "status": 202,
@@ -112,15 +134,19 @@ def display(request):
         )
 
     # get latest screen, or rover if no screen
-    screen = device.get_screen(update_last_seen=True)
-    if not screen:
+    screen = await aget_latest_screen(device)
+    refresh_rate = await aget_refresh_rate(device)
+    await arecord_poll(device, refresh_rate)
+    image_url = None
+    if screen and request.GET.get("base64"):
+        # None if the image has gone missing
+        image_url = await sync_to_async(lambda: screen.image_as_base64)()
+    elif screen:
+        image_url = request.build_absolute_uri(screen.image_as_url_for_device)
+    if image_url is None:
         image_url = request.build_absolute_uri("/static/images/rover.bmp")
         filename = "rover.bmp"
-    elif request.GET.get("base64"):
-        image_url = screen.image_as_base64
-        filename = screen.image_as_url_for_device_filename
     else:
-        image_url = request.build_absolute_uri(screen.image_as_url_for_device)
         filename = screen.image_as_url_for_device_filename
 
     return JsonResponse(
@@ -128,7 +154,7 @@ def display(request):
             "status": 0,
             "image_url": image_url,
             "filename": filename,
-            "refresh_rate": f"{device.refresh_rate}",
+            "refresh_rate": f"{refresh_rate}",
             "reset_firmware": False,
             "update_firmware": False,
             "firmware_url": None,
@@ -139,7 +165,8 @@ def display(request):
 
 
 @csrf_exempt
-def log(request):
+@timed_view("log")
+async def log(request):
     # get Acesss-Token
     api_key = request.headers.get("Access-Token", None)
     if not api_key:
@@ -150,8 +177,8 @@ def log(request):
             },
             status=500,
         )
-    # get device from database
-    device = Device.objects.filter(api_key=api_key).first()
+    # get device from cache or database
+    device = await aget_device_by_api_key(api_key)
     if not device:
         return JsonResponse(
             {
@@ -166,7 +193,16 @@ def log(request):
     except json.JSONDecodeError:
         message = request.body.decode("utf-8")
 
-    device.devicelog_set.create(message=message)
+    if not await log_buffer.aadd(device.pk, message):
+        response = JsonResponse(
+            {
+                "status": 503,
+                "message": "Too many logs, try again later",
+            },
+            status=503,
+        )
+        response["Retry-After"] = settings.LOG_FLUSH_INTERVAL or 1
+        return response
 
     return JsonResponse(
         {
@@ -177,7 +213,8 @@ def log(request):
     )
 
 
-def device_image_view(request, filename):
+@timed_view("device_image")
+async def device_image_view(request, filename):
     device_id, screen_id = filename.replace(".bmp", "").split("-")
     # get api_key from params
     api_key = request.GET.get("api_key", None)
@@ -190,8 +227,12 @@ def device_image_view(request, filename):
             status=404,
         )
 
-    screen = Screen.objects.filter(device__friendly_id=device_id, id=screen_id).first()
-    if not screen or screen.device.api_key != api_key:
+    screen = await (
+        Screen.objects.select_related("device")
+        .filter(device__friendly_id=device_id, id=screen_id)
+        .afirst()
+    )
+    if not screen or screen.device.api_key != api_key or not screen.image_hash:
         return JsonResponse(
             {
                 "status": 404,
@@ -200,12 +241,57 @@ def device_image_view(request, filename):
             status=404,
         )
 
-    return HttpResponse(screen.screen, content_type="image/bmp")
+    # a screen's image never changes once rendered, so its content hash makes
+    # a strong ETag and the response can be cached for good
+    etag = quote_etag(screen.image_hash)
+    last_modified = int((screen.rendered_at or screen.created_at).timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if settings.BLOB_STORE_ACCEL_PREFIX:
+            # let nginx send the file straight from the blob store
+            response = HttpResponse(content_type="image/bmp")
+            response["X-Accel-Redirect"] = (
+                f"{settings.BLOB_STORE_ACCEL_PREFIX}"
+                f"{get_blob_store().key(screen.image_hash)}"
+            )
+        else:
+            image = await sync_to_async(lambda: screen.image)()
+            response = HttpResponse(image, content_type="image/bmp")
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
+
+
+async def screen_html(user_id, data, templates=None):
+    """The HTML of a screen, either given as is or rendered from a template.
+
+    `templates` memoizes template lookups across calls, by name.
+    """
+    if "template" not in data:
+        if not isinstance(data.get("html"), str):
+            raise ValueError("Either html or template is required")
+        return data["html"]
+
+    variables = data.get("variables", {})
+    if not isinstance(variables, dict):
+        raise ValueError("variables must be an object")
+    templates = {} if templates is None else templates
+    name = data["template"]
+    if name not in templates:
+        templates[name] = await ScreenTemplate.objects.filter(
+            user_id=user_id, name=name
+        ).afirst()
+    if templates[name] is None:
+        raise ScreenTemplate.DoesNotExist
+    return templates[name].render(variables)
 
 
 @csrf_exempt
 @require_api_key
-def generate_screen(request):
+@timed_view("generate_screen")
+async def generate_screen(request):
     # get JSON body
     try:
         data = json.loads(request.body.decode("utf-8"))
@@ -218,9 +304,9 @@ def generate_screen(request):
             status=400,
         )
 
-    device = Device.objects.filter(
-        user=request.api_key.user, friendly_id=data["device"].upper()
-    ).first()
+    device = await Device.objects.filter(
+        user_id=request.api_key.user_id, friendly_id=data["device"].upper()
+    ).afirst()
     if not device:
         return JsonResponse(
             {
@@ -230,21 +316,57 @@ def generate_screen(request):
             status=404,
         )
 
-    screen = device.screen_set.create(
-        html=data["html"],
-    )
+    try:
+        html = await screen_html(request.api_key.user_id, data)
+    except ScreenTemplate.DoesNotExist:
+        return JsonResponse(
+            {
+                "status": 404,
+                "message": "Template not found",
+            },
+            status=404,
+        )
+    except ValueError as e:
+        return JsonResponse(
+            {
+                "status": 400,
+                "message": str(e),
+            },
+            status=400,
+        )
+
+    screen = Screen(device=device, html=html)
+
+    # identical HTML that was already rendered is served straight from the
+    # render cache, there is nothing worth queueing
+    if data.get("async", settings.RENDER_QUEUE) and not is_render_cached(screen.html):
+        await sync_to_async(enqueue)(screen)
+        return JsonResponse(
+            {
+                "status": 202,
+                "message": "Screenshot queued",
+                "job_id": screen.id,
+                "status_url": request.build_absolute_uri(
+                    reverse("screen_status", args=[screen.id])
+                ),
+            },
+            status=202,
+        )
 
     try:
-        screen.generate_screen()
+        shown = await screen.agenerate_new_screen()
         return JsonResponse(
             {
                 "status": 200,
-                "message": "Screenshot created",
-                "image": screen.image_as_base64,
+                "message": (
+                    "Screen unchanged" if shown is not screen else "Screenshot created"
+                ),
+                "image": await sync_to_async(lambda: shown.image_as_base64)(),
             },
             status=200,
         )
     except Exception as e:
+        await screen.amark_failed(e)
         return JsonResponse(
             {
                 "status": 500,
@@ -254,14 +376,176 @@ def generate_screen(request):
         )
 
 
+def _batch_result(index, screen, unchanged, request):
+    result = {
+        "index": index,
+        "device": screen.device.friendly_id,
+        "job_id": screen.id,
+        "status_url": request.build_absolute_uri(
+            reverse("screen_status", args=[screen.id])
+        ),
+    }
+    if unchanged:
+        result.update(status=200, message="Screen unchanged")
+    elif screen.status == Screen.Status.FAILED:
+        result.update(status=500, message=f"Error creating screenshot: {screen.error}")
+    elif screen.status == Screen.Status.DONE:
+        result.update(status=200, message="Screenshot created")
+    else:
+        result.update(status=202, message="Screenshot queued")
+    return result
+
+
+@csrf_exempt
+@require_api_key
+@timed_view("generate_screens")
+async def generate_screens(request):
+    """Create screens for many devices in one request.
+
+    Identical HTML is rendered once, no matter how many devices it is for.
+    Results come back in request order, or as NDJSON lines as soon as each
+    one is ready with "stream": true.
+    """
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+        items = data["screens"]
+        if not isinstance(items, list) or not all(
+            isinstance(item, dict) for item in items
+        ):
+            raise ValueError
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse(
+            {
+                "status": 400,
+                "message": "Invalid request",
+            },
+            status=400,
+        )
+    if len(items) > settings.BATCH_MAX_SCREENS:
+        return JsonResponse(
+            {
+                "status": 400,
+                "message": f"At most {settings.BATCH_MAX_SCREENS} screens per request",
+            },
+            status=400,
+        )
+
+    user_id = request.api_key.user_id
+    friendly_ids = {str(item.get("device", "")).upper() for item in items}
+    devices = {
+        device.friendly_id: device
+        async for device in Device.objects.filter(
+            user_id=user_id, friendly_id__in=friendly_ids
+        )
+    }
+
+    # work out every item's HTML, grouping the devices that share it
+    errors = []
+    groups = {}
+    templates = {}
+    for index, item in enumerate(items):
+        device = devices.get(str(item.get("device", "")).upper())
+        if not device:
+            errors.append(
+                {"index": index, "status": 404, "message": "Device not found"}
+            )
+            continue
+        try:
+            html = await screen_html(user_id, item, templates)
+        except ScreenTemplate.DoesNotExist:
+            errors.append(
+                {"index": index, "status": 404, "message": "Template not found"}
+            )
+            continue
+        except ValueError as e:
+            errors.append({"index": index, "status": 400, "message": str(e)})
+            continue
+        groups.setdefault(html, []).append((index, device))
+
+    queue = data.get("async", settings.RENDER_QUEUE)
+
+    async def create(html, targets):
+        indexes, group_devices = zip(*targets)
+        if queue and not is_render_cached(html):
+            screens = await aqueue_screens(html, group_devices)
+        else:
+            screens = await arender_screens(html, group_devices)
+        return [
+            _batch_result(index, screen, unchanged, request)
+            for index, (screen, unchanged) in zip(indexes, screens)
+        ]
+
+    tasks = [asyncio.ensure_future(create(*group)) for group in groups.items()]
+
+    if data.get("stream"):
+
+        async def stream():
+            try:
+                for result in errors:
+                    yield json.dumps(result) + "\n"
+                for task in asyncio.as_completed(tasks):
+                    for result in await task:
+                        yield json.dumps(result) + "\n"
+            finally:
+                # the client went away, don't leave renders running for nobody
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+    results = errors + [
+        result for group in await asyncio.gather(*tasks) for result in group
+    ]
+    results.sort(key=lambda result: result["index"])
+    return JsonResponse({"status": 200, "results": results}, status=200)
+
+
+@require_api_key
+@timed_view("screen_status")
+async def screen_status(request, screen_id):
+    screen = await Screen.objects.filter(
+        device__user_id=request.api_key.user_id, id=screen_id
+    ).afirst()
+    if not screen:
+        return JsonResponse(
+            {
+                "status": 404,
+                "message": "Screen not found",
+            },
+            status=404,
+        )
+
+    response = {
+        "status": 200,
+        "job_id": screen.id,
+        "state": screen.status,
+    }
+    if screen.status in (Screen.Status.DONE, Screen.Status.UNCHANGED):
+        response["image"] = await sync_to_async(lambda: screen.image_as_base64)()
+        response["changed_pixels"] = screen.changed_pixels
+        response["changed_regions"] = screen.changed_regions
+    elif screen.status == Screen.Status.FAILED:
+        response["message"] = f"Error creating screenshot: {screen.error}"
+    return JsonResponse(response, status=200)
+
+
 @login_required(login_url="/admin/login/")
 def preview(request):
     return render(
         request,
         "live_preview.html",
-        {
-            "initial_content": base64.b64encode(
-                open("templates/base.html").read().encode()
-            ).decode()
-        },
+        {"initial_content": base64.b64encode(base_html().encode()).decode()},
+    )
+
+
+def metrics(request):
+    # off unless a token is set, so metrics are never public by accident
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=404)
+    if not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        expose(), content_type="text/plain; version=0.0.4; charset=utf-8"
     )